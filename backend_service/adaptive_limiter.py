@@ -0,0 +1,129 @@
+"""
+自适应并发限制（AIMD）：
+- 成功且延迟平稳：每满一个窗口的成功请求，上限 +1（加性增）
+- 短期平均延迟明显高于长期基线，或出现超时/后端错误：上限按比例下降（乘性减）
+  延迟基线按调用点（site）分别维护：章节/分节调用天然比短 JSON 调用慢一个量级，
+  混在一起时调用结构的变化会被误判成服务端变慢。
+超过上限的调用排队等待；队列过长或等待超时直接拒绝，避免请求在服务端堆积到全部超时。
+"""
+import threading
+import time
+
+
+class LimiterRejected(Exception):
+    pass
+
+
+class AdaptiveLimiter:
+    def __init__(
+        self,
+        initial: int,
+        min_limit: int,
+        max_limit: int,
+        max_queue: int,
+        queue_timeout: float,
+        latency_tolerance: float = 1.5,
+        backoff: float = 0.5,
+        latency_backoff: float = 0.9,
+        min_samples: int = 5,
+    ):
+        self.min_limit = max(1, min_limit)
+        self.max_limit = max(self.min_limit, max_limit)
+        self.limit = float(min(max(initial, self.min_limit), self.max_limit))
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.latency_tolerance = latency_tolerance
+        self.backoff = backoff
+        self.latency_backoff = latency_backoff
+        self.min_samples = max(1, min_samples)
+        self.in_flight = 0
+        self.queued = 0
+        # site -> {"short": 短期均值, "long": 长期基线, "samples": 上次回退后的样本数}
+        self._rtt: dict[str, dict] = {}
+        self._last_decrease = 0.0
+        self._cond = threading.Condition()
+        self._stats = {"acquired": 0, "rejected": 0, "increases": 0, "decreases": 0}
+
+    def _capacity(self) -> int:
+        return max(self.min_limit, int(self.limit))
+
+    def acquire(self) -> None:
+        """占用一个并发槽位；排队超过 max_queue 或等待超过 queue_timeout 时抛出 LimiterRejected。"""
+        with self._cond:
+            if self.in_flight >= self._capacity():
+                if self.queued >= self.max_queue:
+                    self._stats["rejected"] += 1
+                    raise LimiterRejected(f"queue full ({self.queued})")
+                self.queued += 1
+                deadline = time.monotonic() + self.queue_timeout
+                try:
+                    while self.in_flight >= self._capacity():
+                        remaining = deadline - time.monotonic()
+                        if remaining <= 0:
+                            self._stats["rejected"] += 1
+                            raise LimiterRejected(f"waited {self.queue_timeout}s for a slot")
+                        self._cond.wait(remaining)
+                finally:
+                    self.queued -= 1
+            self.in_flight += 1
+            self._stats["acquired"] += 1
+
+    def release(self, elapsed: float | None, outcome: str = "ok", site: str = "default") -> None:
+        """
+        归还槽位并根据结果调整上限。
+        outcome: ok 计入延迟样本；dropped 为超时/后端错误；ignore 不参与调整（如调用方取消）。
+        site: 调用点，延迟只与同一调用点的基线比较。
+        """
+        with self._cond:
+            self.in_flight -= 1
+            if outcome == "dropped":
+                self._decrease(self.backoff)
+            elif outcome == "ok" and elapsed is not None:
+                self._sample(site, elapsed)
+            self._cond.notify_all()
+
+    def _sample(self, site: str, rtt: float) -> None:
+        state = self._rtt.get(site)
+        if state is None:
+            state = self._rtt[site] = {"short": rtt, "long": rtt, "samples": 0}
+        else:
+            state["short"] = state["short"] * 0.7 + rtt * 0.3
+            state["long"] = state["long"] * 0.95 + rtt * 0.05
+        state["samples"] += 1
+        # 样本太少时短期均值只是少数几次调用的噪声，不据此回退
+        if state["samples"] >= self.min_samples and state["short"] > state["long"] * self.latency_tolerance:
+            # 延迟上升比超时温和，小幅回退
+            self._decrease(self.latency_backoff)
+        elif self.in_flight + 1 >= self._capacity() * 0.5 and self.limit < self.max_limit:
+            # 只有实际用到一半以上上限时才增长，避免空闲期间上限虚高
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+            self._stats["increases"] += 1
+
+    def _decrease(self, factor: float) -> None:
+        now = time.monotonic()
+        # 同一波失败/变慢只减一次，在途请求的结果反映的是减之前的负载
+        if now - self._last_decrease < 1.0:
+            return
+        self._last_decrease = now
+        self.limit = max(float(self.min_limit), self.limit * factor)
+        self._stats["decreases"] += 1
+        for state in self._rtt.values():
+            # 下调后把短期均值拉回基线，攒够新的样本再判断
+            state["short"] = state["long"]
+            state["samples"] = 0
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "limit": self._capacity(),
+                "limit_exact": round(self.limit, 2),
+                "min_limit": self.min_limit,
+                "max_limit": self.max_limit,
+                "in_flight": self.in_flight,
+                "queue_depth": self.queued,
+                "rtt": {
+                    site: {"short": round(state["short"], 3), "long": round(state["long"], 3)}
+                    for site, state in self._rtt.items()
+                },
+                **self._stats,
+            }
@@ -1,25 +1,73 @@
+import functools
+import hashlib
 import json
 import os
 import re
 import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
 from typing import Optional
 
 import requests
 from fastapi import APIRouter, Depends, HTTPException, Query
 from sqlalchemy.orm import Session
-
-from database import SessionLocal
+from sqlalchemy.orm.attributes import set_committed_value
+
+from database import SessionLocal, session_scope
+import llm_client
+from prompt_budget import (
+    LLM_CONTEXT_TOKENS,
+    LLM_OUTPUT_RESERVE,
+    PromptPart,
+    estimate_tokens,
+    fit_prompt,
+    split_to_tokens,
+)
 from minio_client import BUCKET, client
-from models import FileRecord, Project
+from models import FileRecord, PipelineTask, Project
 from models import TenderAnalysis as TenderAnalysisModel, DocumentContent
 from schemas import TenderAnalysis
+from singleflight import SingleFlight
+from tasks import submit_task
 from text_parser import parse_file_bytes
 from vector_store import search_chunks
+from .export import EXPORT_PREFIX
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# 知识库查询并发数与整体时限（秒），超时未返回的查询直接丢弃
+ANYTHINGLLM_CONCURRENCY = int(os.getenv("ANYTHINGLLM_CONCURRENCY", "6"))
+ANYTHINGLLM_DEADLINE = float(os.getenv("ANYTHINGLLM_DEADLINE", "50"))
+
+# 解析模式：excerpt 仅取原文前 2000 字；mapreduce 分段抽取全文后合并
+ANALYSIS_MODES = ("excerpt", "mapreduce")
+ANALYSIS_MODE = os.getenv("ANALYSIS_MODE", "excerpt")
+# 每段的目标字数；实际段长同时受提示词 token 预算限制，不会为减少段数而放大
+MAPREDUCE_SECTION_CHARS = int(os.getenv("MAPREDUCE_SECTION_CHARS", "6000"))
+# 段数超过该值时只记录告警，多出的段照常经有界线程池抽取
+MAPREDUCE_MAX_SECTIONS = int(os.getenv("MAPREDUCE_MAX_SECTIONS", "24"))
+MAPREDUCE_CONCURRENCY = int(os.getenv("MAPREDUCE_CONCURRENCY", "4"))
+# JSON 类提示词使用流式调用，收到完整 JSON 对象后立即断开
+OLLAMA_JSON_STREAM = os.getenv("OLLAMA_JSON_STREAM", "1").lower() not in ("0", "false", "no")
+
+
+# 相同的知识库查询 / 同一项目的同步解析并发到达时只执行一次
+_kb_flight = SingleFlight("anythingllm")
+_analysis_flight = SingleFlight("analysis")
+
+
+def _analysis_key(project_id: int, refresh: bool, mode: str | None) -> str:
+    """同步单飞与后台任务共用的合并键：项目、是否刷新、解析模式（已取默认值）。"""
+    return f"{project_id}:{int(refresh)}:{mode or ANALYSIS_MODE}"
+
+# 本进程内进行中的后台解析任务：与同步解析相同的合并键 -> job_id
+# 进程重启后遗留的 Pending/InProgress 记录不在其中，不会被复用
+_running_analysis_jobs: dict[str, int] = {}
+_running_jobs_lock = threading.Lock()
+ANALYSIS_JOB_INTERRUPTED = "服务重启，解析任务已中断，请重新发起"
+
 
 def get_db():
     db = SessionLocal()
@@ -30,6 +78,10 @@ def get_db():
 
 
 def _query_anythingllm(question: str) -> Optional[str]:
+    return _kb_flight.do(question, lambda: _post_anythingllm(question))
+
+
+def _post_anythingllm(question: str) -> Optional[str]:
     base = os.getenv("ANYTHINGLLM_BASE")
     api_key = os.getenv("ANYTHINGLLM_API_KEY")
     if not base or not api_key:
@@ -48,41 +100,73 @@ def _query_anythingllm(question: str) -> Optional[str]:
         return None
 
 
-def _call_llm(prompt: str) -> str:
-    base = os.getenv("OLLAMA_BASE")
-    model = os.getenv("OLLAMA_MODEL", "qwen3:14B")
-    timeout = int(os.getenv("OLLAMA_TIMEOUT", "300"))
-    if not base:
-        raise HTTPException(status_code=500, detail="OLLAMA_BASE not configured")
+def query_anythingllm_many(queries: list[str], deadline: float | None = None) -> list[str]:
+    """
+    并发发送知识库查询，在 deadline 内保留已返回的答案。
+    返回按 queries 原顺序排列的 "【query】\nanswer" 列表。
+    """
+    if not queries:
+        return []
+    deadline = ANYTHINGLLM_DEADLINE if deadline is None else deadline
+    pool = ThreadPoolExecutor(max_workers=max(1, min(ANYTHINGLLM_CONCURRENCY, len(queries))))
     try:
-        payload = {
-            "model": model,
-            "prompt": prompt,
-            # 关闭流式，避免多行 JSON 难以解析
-            "stream": False,
-        }
-        resp = requests.post(f"{base}/api/generate", json=payload, timeout=timeout)
-        resp.raise_for_status()
-    except requests.exceptions.Timeout:
-        raise HTTPException(status_code=504, detail="LLM请求超时，请检查模型是否已加载或调大 OLLAMA_TIMEOUT")
-    except Exception as exc:
-        raise HTTPException(status_code=502, detail=f"LLM 请求失败: {exc}")
-    # 优先解析 JSON；若失败尝试逐行 JSON 解析；最后返回原始文本
+        futures = [pool.submit(_query_anythingllm, q) for q in queries]
+        done, not_done = wait(futures, timeout=deadline)
+    finally:
+        # 不等待超时的查询，避免拖慢整个知识库阶段
+        pool.shutdown(wait=False, cancel_futures=True)
+    if not_done:
+        logger.warning("anythingllm queries exceeded deadline | deadline=%ss dropped=%s", deadline, len(not_done))
+    answers: list[str] = []
+    for q, fut in zip(queries, futures):
+        if fut not in done:
+            continue
+        try:
+            ans = fut.result()
+        except Exception as exc:
+            logger.warning("anythingllm query failed | q=%s | %s", q, exc)
+            continue
+        if ans:
+            answers.append(f"【{q}】\n{ans}")
+    return answers
+
+
+def _call_llm(prompt: str, refresh: bool = False, site: str = "analysis") -> str:
+    return _llm_call(llm_client.generate, prompt, refresh, site)
+
+
+def _call_llm_json(prompt: str, refresh: bool = False, site: str = "analysis") -> str:
+    """
+    流式调用，首个完整 JSON 对象到达即断开，避免等待模型输出 JSON 之后的多余文本。
+    OLLAMA_JSON_STREAM=0 时退回普通调用。
+    """
+    if OLLAMA_JSON_STREAM:
+        fn = llm_client.generate_json
+    else:
+        # 普通调用只缓存能解析出 JSON 对象的响应，解析失败的输出下次重新生成
+        fn = functools.partial(llm_client.generate, validate=_is_json_response)
+    return _llm_call(fn, prompt, refresh, site)
+
+
+def _is_json_response(text: str) -> bool:
     try:
-        data = resp.json()
+        return isinstance(_parse_llm_json(text), dict)
     except Exception:
-        lines = [l for l in resp.text.splitlines() if l.strip()]
-        data = None
-        for line in lines:
-            try:
-                data = json.loads(line)
-                break
-            except Exception:
-                continue
-        if not data:
-            logger.warning("LLM 原始文本预览（非 JSON）: %s", (resp.text or "")[:400])
-            return resp.text
-    return data.get("response") or data.get("message") or json.dumps(data)
+        return False
+
+
+def _llm_call(fn, prompt: str, refresh: bool, site: str) -> str:
+    """调用 llm_client 并把客户端异常转换为 HTTP 错误。"""
+    try:
+        return fn(prompt, site=site, refresh=refresh)
+    except llm_client.LLMConfigError as exc:
+        raise HTTPException(status_code=500, detail=str(exc))
+    except llm_client.LLMOverloadedError:
+        raise HTTPException(status_code=503, detail="LLM 服务繁忙，请稍后重试")
+    except llm_client.LLMTimeoutError:
+        raise HTTPException(status_code=504, detail="LLM请求超时，请检查模型是否已加载（可开启 OLLAMA_WARMUP 预热）或调大 OLLAMA_TIMEOUT")
+    except llm_client.LLMError as exc:
+        raise HTTPException(status_code=502, detail=f"LLM 请求失败: {exc}")
 
 
 def _is_textual(filename: str, content_type: str | None) -> bool:
@@ -94,12 +178,13 @@ def _is_textual(filename: str, content_type: str | None) -> bool:
     return False
 
 
-def _read_raw_text(files: list[FileRecord], max_chars: int = 2000) -> str:
+def _read_raw_text(files: list[FileRecord], max_chars: int | None = 2000) -> str:
     """
     直接从 MinIO 读取原文做推理上下文，不做本地 chunk/embedding 持久化。
+    max_chars 为 None 时读取全文。
     """
     snippets: list[str] = []
-    budget = max_chars
+    budget = max_chars if max_chars is not None else float("inf")
     for f in files:
         if budget <= 0:
             break
@@ -120,12 +205,55 @@ def _read_raw_text(files: list[FileRecord], max_chars: int = 2000) -> str:
         raw = "\n".join(chunks)
         if not raw:
             continue
-        trimmed = raw[:budget]
+        trimmed = raw if max_chars is None else raw[:budget]
         snippets.append(f"[{f.filename}]\n{trimmed}")
         budget -= len(trimmed)
     return "\n\n".join(snippets)
 
 
+def list_source_files(db: Session, project_id: int) -> list[FileRecord]:
+    """项目下作为分析输入的招标文件（排除生成的导出文件），按上传时间倒序。"""
+    return (
+        db.query(FileRecord)
+        .filter(
+            FileRecord.project_id == project_id,
+            ~FileRecord.object_name.like(f"{EXPORT_PREFIX}%"),
+        )
+        .order_by(FileRecord.created_at.desc())
+        .all()
+    )
+
+
+def _file_content_hash(f: FileRecord) -> str:
+    """
+    优先使用上传时记录的 sha256；旧记录回退到 MinIO ETag，再回退到大小。
+    ETag 取到后写回 content_hash，旧文件只在第一次计算指纹时访问 MinIO。
+    """
+    if f.content_hash:
+        return f.content_hash
+    try:
+        value = f"etag:{client.stat_object(BUCKET, f.object_name).etag}"
+    except Exception as exc:
+        logger.warning("stat object failed when fingerprinting | object=%s | %s", f.object_name, exc)
+        return f"size:{f.size or 0}"
+    try:
+        with session_scope() as db:
+            db.query(FileRecord).filter(FileRecord.id == f.id, FileRecord.content_hash.is_(None)).update(
+                {FileRecord.content_hash: value}, synchronize_session=False
+            )
+        # 只更新已加载的值，不把对象标记为待写入，避免混入调用方的事务
+        set_committed_value(f, "content_hash", value)
+    except Exception as exc:
+        logger.warning("backfill file content hash failed | file_id=%s | %s", f.id, exc)
+    return value
+
+
+def input_fingerprint(files: list[FileRecord]) -> str:
+    """输入文件集合（id + 内容哈希）的指纹，文件新增、删除或内容变化时改变。"""
+    parts = sorted(f"{f.id}:{_file_content_hash(f)}" for f in files)
+    return hashlib.sha256("\n".join(parts).encode("utf-8")).hexdigest()
+
+
 def _parse_llm_json(raw: str | dict) -> dict:
     """
     尽可能宽容地从 LLM 响应中提取首个 JSON 对象。
@@ -159,14 +287,22 @@ def _parse_llm_json(raw: str | dict) -> dict:
 DEFAULT_SUMMARY_PLACEHOLDER = "暂无模型总结，请检查招标文件与模型输出。"
 
 
-def _analyze_core(project_id: int, db: Session, refresh: bool = False) -> TenderAnalysis:
+def _analyze_core(
+    project_id: int, db: Session, refresh: bool = False, mode: str | None = None
+) -> TenderAnalysis:
     """
     Flow:
     - fetch project; 404 if missing
     - fetch project files; 400 if none (ask for upload)
-    - return cached result when valid, no new files, and refresh=False
+    - return cached result when valid, input file fingerprint unchanged, and refresh=False
     - otherwise call LLM to regenerate and sync DocumentContent
+      (mode=mapreduce extracts key info from the full text section by section)
+    - DB reads and writes run as two short transactions; the session holds no
+      pooled connection while MinIO / LLM / AnythingLLM calls are in flight
     """
+    mode = mode or ANALYSIS_MODE
+    if mode not in ANALYSIS_MODES:
+        raise HTTPException(status_code=400, detail=f"不支持的解析模式: {mode}")
     project: Project | None = db.query(Project).filter(Project.id == project_id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
@@ -178,12 +314,7 @@ def _analyze_core(project_id: int, db: Session, refresh: bool = False) -> Tender
         .first()
     )
 
-    files = (
-        db.query(FileRecord)
-        .filter(FileRecord.project_id == project_id)
-        .order_by(FileRecord.created_at.desc())
-        .all()
-    )
+    files = list_source_files(db, project_id)
     if not files:
         logger.warning(
             "no tender files when analyzing | project_id=%s cached=%s files_in_db=0",
@@ -191,8 +322,11 @@ def _analyze_core(project_id: int, db: Session, refresh: bool = False) -> Tender
             bool(record),
         )
         raise HTTPException(status_code=400, detail="未找到招标文件，请先上传后再分析")
+    # 结束读事务并归还连接；close 不会使已加载的对象过期，后续只读取其字段
+    db.close()
 
     latest_file_time = files[0].created_at
+    fingerprint = input_fingerprint(files)
     summary_cached = ""
     key_dates_cached: list[dict] = []
     doc_struct_cached: list[dict] = []
@@ -202,7 +336,11 @@ def _analyze_core(project_id: int, db: Session, refresh: bool = False) -> Tender
         summary_cached = record.summary or ""
         key_dates_cached = json.loads(record.key_dates_json or "[]")
         doc_struct_cached = json.loads(record.document_structure_json or "[]")
-        has_new_file = bool(latest_file_time and record.updated_at and record.updated_at < latest_file_time)
+        if record.input_fingerprint:
+            has_new_file = record.input_fingerprint != fingerprint
+        else:
+            # 旧记录没有指纹，沿用时间比较
+            has_new_file = bool(latest_file_time and record.updated_at and record.updated_at < latest_file_time)
         is_placeholder = summary_cached.strip() == DEFAULT_SUMMARY_PLACEHOLDER
         is_cached_valid = (
             bool(summary_cached.strip())
@@ -212,10 +350,10 @@ def _analyze_core(project_id: int, db: Session, refresh: bool = False) -> Tender
         )
         if not refresh and is_cached_valid and not has_new_file:
             logger.info(
-                "analysis cache hit | project_id=%s updated_at=%s latest_file=%s",
+                "analysis cache hit | project_id=%s updated_at=%s fingerprint=%s",
                 project_id,
                 record.updated_at,
-                latest_file_time,
+                fingerprint[:12],
             )
             return TenderAnalysis(
                 summary=summary_cached,
@@ -225,31 +363,30 @@ def _analyze_core(project_id: int, db: Session, refresh: bool = False) -> Tender
 
     file_list_text = "\n".join([f"- {f.filename}" for f in files]) or "(no files)"
 
-    raw_text = _read_raw_text(files)
+    # local TF-IDF snippets for quick grounding（在 LLM 调用前读取，随即归还连接）
+    chunk_hits = search_chunks(db, project_id, project.name, top_k=5)
+    db.close()
+    citations_text = "\n".join([f"[chunk{i+1}] {c[1][:200]}" for i, c in enumerate(chunk_hits)])
 
-    # === NEW: extract key info with Ollama ===
-    key_info = extract_key_info_with_ollama(raw_text)
+    if mode == "mapreduce":
+        full_text = _read_raw_text(files, max_chars=None)
+        raw_text = full_text[:2000]
+        key_info = map_reduce_key_info(full_text, refresh=refresh)
+    else:
+        raw_text = _read_raw_text(files)
+        # === NEW: extract key info with Ollama ===
+        key_info = extract_key_info_with_ollama(raw_text, refresh=refresh)
     logger.info("extracted tender key info: %s", key_info)
 
     # === NEW: targeted AnythingLLM queries ===
     queries = build_anythingllm_queries(key_info, project.name)
 
-    kb_answers: list[str] = []
-    for q in queries:
-        try:
-            ans = _query_anythingllm(q)
-            if ans:
-                kb_answers.append(f"【{q}】\n{ans}")
-        except Exception as exc:
-            logger.warning("anythingllm query failed | q=%s | %s", q, exc)
+    kb_answers = query_anythingllm_many(queries)
 
     kb_answer = "\n\n".join(kb_answers) or "knowledge base empty"
 
-    # local TF-IDF snippets for quick grounding
-    chunk_hits = search_chunks(db, project_id, project.name, top_k=5)
-    citations_text = "\n".join([f"[chunk{i+1}] {c[1][:200]}" for i, c in enumerate(chunk_hits)])
-
-    prompt = f"""你是一位招投标文件分析专家。目标是基于招标原文与知识库要点，输出“可供后续投标书生成使用”的概要与章节提纲（不写正文）。
+    def build_prompt(key_info_text: str, kb_answer: str, raw_text: str, citations: str) -> str:
+        return f"""你是一位招投标文件分析专家。目标是基于招标原文与知识库要点，输出“可供后续投标书生成使用”的概要与章节提纲（不写正文）。
 
     你的输出的 documentStructure 必须包含投标书中常见的、特别是涉及商务、技术、价格和符合性判断的**核心章节**，例如：**投标函、技术方案、商务和技术偏离表、报价表、资质证明文件、业绩**等。
     若原文未明确，也必须补齐上述核心章节，并严格按下述模板的编号与顺序组织（可在 sections 中增补要点，但不得删除模板项或改编号）：
@@ -266,10 +403,10 @@ def _analyze_core(project_id: int, db: Session, refresh: bool = False) -> Tender
     - documentStructure: 数组，每项包含 id、title、sections；sections 为字符串数组（小节要点，勿写正文）。
 
     输入信息（仅供参考，不要原样输出标签）：
-    关键信息：{json.dumps(key_info, ensure_ascii=False) if key_info else "无"}
+    关键信息：{key_info_text or "无"}
     知识库要点：{kb_answer or "无"}
     原文摘录：{raw_text or "无原文摘录"}
-    本地TFIDF片段：{citations_text or "无"}
+    本地TFIDF片段：{citations or "无"}
 
     输出格式示例（请严格遵循字段名和类型，生成真实内容，勿输出示例字样）：
     {{
@@ -289,11 +426,23 @@ def _analyze_core(project_id: int, db: Session, refresh: bool = False) -> Tender
     - 字段必须包含 summary、keyDates、documentStructure，类型必须匹配。
     - sections 只写要点/占位符，不写正文内容。
     """
+
+    # 按优先级分配上下文：关键信息 > 原文 > 知识库 > TF-IDF 片段
+    prompt = fit_prompt(
+        build_prompt,
+        [
+            PromptPart("key_info_text", json.dumps(key_info, ensure_ascii=False) if key_info else "", priority=0),
+            PromptPart("raw_text", raw_text, priority=1, min_tokens=300),
+            PromptPart("kb_answer", kb_answer, priority=2),
+            PromptPart("citations", citations_text, priority=3),
+        ],
+        label=f"analysis project={project_id}",
+    )
     
     logger.info("LLM 提示词 (project %s):\n%s", project_id, prompt[:2000])
     llm_resp: str | dict | None = None
     try:
-        llm_resp = _call_llm(prompt)
+        llm_resp = _call_llm_json(prompt, refresh=refresh)
         logger.warning("LLM 原始响应预览: %s", (str(llm_resp)[:400] if llm_resp is not None else "<no-response>"))
         parsed = _parse_llm_json(llm_resp)
     except HTTPException:
@@ -325,6 +474,13 @@ def _analyze_core(project_id: int, db: Session, refresh: bool = False) -> Tender
                 key_dates.append({"label": str(label), "date": str(date_val)})
             else:
                 key_dates.append({"label": str(item), "date": ""})
+    if not key_dates and isinstance(key_info.get("key_dates"), list):
+        # 分段抽取得到的时间节点作为兜底
+        key_dates = [
+            {"label": str(d.get("label") or "关键时间"), "date": str(d.get("date") or "")}
+            for d in key_info["key_dates"]
+            if isinstance(d, dict)
+        ]
     if not key_dates:
         key_dates = [
             {"label": "投标截止", "date": "待定"},
@@ -456,18 +612,22 @@ def _analyze_core(project_id: int, db: Session, refresh: bool = False) -> Tender
     if not summary.strip() or summary.strip() == "暂无模型总结，请检查招标文件与模型输出。":
         logger.warning("LLM输出为空或占位，使用占位 summary | raw=%s", raw_preview)
 
-    if record:
-        record.summary = summary
-        record.key_dates_json = json.dumps(key_dates, ensure_ascii=False)
-        record.document_structure_json = json.dumps(doc_struct, ensure_ascii=False)
-        new_record = record
-    else:
-        new_record = TenderAnalysisModel(
-            project_id=project_id,
-            summary=summary,
-            key_dates_json=json.dumps(key_dates, ensure_ascii=False),
-            document_structure_json=json.dumps(doc_struct, ensure_ascii=False),
-        )
+    # 写回阶段：新的短事务，重新读取最新记录（LLM 调用期间可能已有其他解析写入）
+    new_record = (
+        db.query(TenderAnalysisModel)
+        .filter(TenderAnalysisModel.project_id == project_id)
+        .order_by(TenderAnalysisModel.updated_at.desc())
+        .first()
+    ) or TenderAnalysisModel(project_id=project_id)
+    new_record.summary = summary
+    new_record.key_dates_json = json.dumps(key_dates, ensure_ascii=False)
+    new_record.document_structure_json = json.dumps(doc_struct, ensure_ascii=False)
+    # 保存中间结果，生成阶段在输入文件未变化时直接复用
+    new_record.key_info_json = json.dumps(key_info or {}, ensure_ascii=False)
+    new_record.kb_queries_json = json.dumps(queries, ensure_ascii=False)
+    new_record.kb_answers_json = json.dumps(kb_answers, ensure_ascii=False)
+    new_record.raw_text_excerpt = raw_text
+    new_record.input_fingerprint = fingerprint
     db.add(new_record)
 
     # 初始化结构：仅在正文不存在时补充 structure 字段，避免覆盖生成的正文内容
@@ -486,7 +646,7 @@ def _analyze_core(project_id: int, db: Session, refresh: bool = False) -> Tender
             doc_content = DocumentContent(project_id=project_id)
         doc_content.content_json = json.dumps(existing, ensure_ascii=False)
         db.add(doc_content)
-        db.commit()
+    db.commit()
 
     return TenderAnalysis(
         summary=summary,
@@ -494,7 +654,7 @@ def _analyze_core(project_id: int, db: Session, refresh: bool = False) -> Tender
         documentStructure=doc_struct,
     )
 
-def extract_key_info_with_ollama(raw_text: str) -> dict:
+def extract_key_info_with_ollama(raw_text: str, refresh: bool = False) -> dict:
     """
     Use local Ollama model to extract key tender information
     for downstream knowledge-base querying.
@@ -515,7 +675,7 @@ def extract_key_info_with_ollama(raw_text: str) -> dict:
     """
 
     try:
-        resp = _call_llm(prompt)  # 本地 Ollama 模型调用
+        resp = _call_llm_json(prompt, refresh=refresh, site="key_info")  # 本地 Ollama 模型调用
 
         logger.warning(
             "[Ollama] raw response preview:\n%s",
@@ -529,6 +689,135 @@ def extract_key_info_with_ollama(raw_text: str) -> dict:
         return {}
 
 
+_SECTION_HEADING_RE = re.compile(r"第[一二三四五六七八九十百零〇\d]+[章部分篇]")
+
+
+def _section_token_budget() -> int:
+    """单段原文可用的 token：上下文减去输出预留与抽取提示词模板本身。"""
+    overhead = estimate_tokens(_section_prompt("", 9999, 9999))
+    return max(LLM_CONTEXT_TOKENS - LLM_OUTPUT_RESERVE - overhead, 256)
+
+
+def _split_sections(
+    text: str, section_chars: int = MAPREDUCE_SECTION_CHARS, max_tokens: int | None = None
+) -> list[str]:
+    """
+    按“第X章/部分/篇”切分全文，再把相邻小段合并到 section_chars 左右；
+    每段同时不超过 max_tokens（默认取提示词预算），超长段落按 token 硬切。
+    长文档因此得到更多段，而不是更大的段，抽取指令始终完整留在上下文内。
+    """
+    text = (text or "").strip()
+    if not text:
+        return []
+    max_tokens = max_tokens or _section_token_budget()
+    starts = [0] + [m.start() for m in _SECTION_HEADING_RE.finditer(text) if m.start() > 0]
+    pieces = [text[a:b] for a, b in zip(starts, starts[1:] + [len(text)])]
+
+    def fits(chunk: str) -> bool:
+        return len(chunk) <= section_chars and estimate_tokens(chunk) <= max_tokens
+
+    sections: list[str] = []
+    current = ""
+    for piece in pieces:
+        if not fits(piece):
+            # 超长段落先按 token 上限、再按字数上限硬切
+            if current:
+                sections.append(current)
+                current = ""
+            for part in split_to_tokens(piece, max_tokens):
+                sections.extend(part[i : i + section_chars] for i in range(0, len(part), section_chars))
+            continue
+        if current and not fits(current + piece):
+            sections.append(current)
+            current = ""
+        current += piece
+    if current.strip():
+        sections.append(current)
+    return [sec.strip() for sec in sections if sec.strip()]
+
+
+def _section_prompt(section: str, index: int, total: int) -> str:
+    return f"""
+    你是招标文件的关键信息抽取器。以下是招标文件的第 {index + 1}/{total} 段，请只基于本段原文提取，输出 JSON（不要解释、不用 Markdown），字段：
+    - project_type: 简短项目类型（如“网络安全运营服务”），本段未提及则为空字符串。
+    - core_tech: 关键技术/服务能力关键词数组。
+    - qualification: 必须的资质/证书/人员要求数组。
+    - scoring_focus: 评分办法中明确影响得分的要点数组。
+    - risk_points: 废标或重大扣分风险数组。
+    - key_dates: 时间节点数组，每项包含 label、date。
+    - bid_sections: 本段要求投标文件必须包含的章节或材料名称数组。
+    本段未涉及的字段输出空数组。
+
+    招标文件原文（第 {index + 1} 段）：
+    {section}
+    """
+
+
+def _extract_section_info(section: str, index: int, total: int, refresh: bool = False) -> dict:
+    # 切分时已按预算控制段长，这里兜底保证提示词不超出上下文
+    prompt = fit_prompt(
+        lambda section: _section_prompt(section, index, total),
+        [PromptPart("section", section, priority=0)],
+        label=f"key_info section {index + 1}/{total}",
+    )
+    try:
+        parsed = _parse_llm_json(_call_llm_json(prompt, refresh=refresh, site="key_info_section"))
+        return parsed if isinstance(parsed, dict) else {}
+    except Exception as exc:
+        logger.warning("section key info extraction failed | section=%s/%s | %s", index + 1, total, exc)
+        return {}
+
+
+def _merge_key_info(parts: list[dict]) -> dict:
+    """
+    按段落顺序确定性合并：project_type 取出现次数最多者（并列取最先出现），
+    列表字段按首次出现顺序去重。
+    """
+    list_fields = ["core_tech", "qualification", "scoring_focus", "risk_points", "key_dates", "bid_sections"]
+    merged: dict = {field: [] for field in list_fields}
+    seen: dict[str, set] = {field: set() for field in list_fields}
+    type_counts: dict[str, int] = {}
+    type_order: list[str] = []
+    for part in parts:
+        project_type = str(part.get("project_type") or "").strip()
+        if project_type:
+            if project_type not in type_counts:
+                type_order.append(project_type)
+            type_counts[project_type] = type_counts.get(project_type, 0) + 1
+        for field in list_fields:
+            values = part.get(field) or []
+            if not isinstance(values, list):
+                values = [values]
+            for v in values:
+                marker = json.dumps(v, ensure_ascii=False, sort_keys=True) if isinstance(v, (dict, list)) else str(v).strip()
+                if not marker or marker in seen[field]:
+                    continue
+                seen[field].add(marker)
+                merged[field].append(v)
+    merged["project_type"] = max(type_order, key=lambda t: type_counts[t]) if type_order else ""
+    return merged
+
+
+def map_reduce_key_info(full_text: str, refresh: bool = False) -> dict:
+    """分段并发抽取关键信息后合并；同时在途的调用数受 MAPREDUCE_CONCURRENCY 限制。"""
+    sections = _split_sections(full_text)
+    if not sections:
+        return {}
+    total = len(sections)
+    if total > MAPREDUCE_MAX_SECTIONS:
+        logger.warning(
+            "map-reduce sections exceed MAPREDUCE_MAX_SECTIONS | sections=%s max=%s chars=%s",
+            total,
+            MAPREDUCE_MAX_SECTIONS,
+            len(full_text),
+        )
+    workers = max(1, min(MAPREDUCE_CONCURRENCY, total))
+    logger.info("map-reduce analysis | sections=%s concurrency=%s chars=%s", total, workers, len(full_text))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        parts = list(pool.map(lambda i: _extract_section_info(sections[i], i, total, refresh), range(total)))
+    return _merge_key_info(parts)
+
+
 def build_anythingllm_queries(extracted: dict, project_name: str) -> list[str]:
     """
     Build targeted AnythingLLM queries based on extracted key info.
@@ -580,12 +869,143 @@ def build_anythingllm_queries(extracted: dict, project_name: str) -> list[str]:
     return queries
 
 
-@router.post("/{project_id}", response_model=TenderAnalysis)
-def analyze(project_id: int, refresh: bool = Query(False), db: Session = Depends(get_db)):
-    return _analyze_core(project_id, db, refresh=refresh)
+def _read_stored_analysis(db: Session, project_id: int) -> TenderAnalysis | None:
+    """读取已保存的解析结果；招标文件在解析后有新增、删除或变化时 stale=True。"""
+    record = (
+        db.query(TenderAnalysisModel)
+        .filter(TenderAnalysisModel.project_id == project_id)
+        .order_by(TenderAnalysisModel.updated_at.desc())
+        .first()
+    )
+    if not record:
+        return None
+    files = list_source_files(db, project_id)
+    if record.input_fingerprint:
+        stale = record.input_fingerprint != input_fingerprint(files)
+    else:
+        # 旧记录没有指纹，沿用时间比较
+        latest_file_time = files[0].created_at if files else None
+        stale = bool(latest_file_time and record.updated_at and record.updated_at < latest_file_time)
+    return TenderAnalysis(
+        summary=record.summary or "",
+        keyDates=json.loads(record.key_dates_json or "[]"),
+        documentStructure=json.loads(record.document_structure_json or "[]"),
+        stale=stale,
+    )
+
+
+def _job_to_dict(job: PipelineTask) -> dict:
+    return {
+        "jobId": job.id,
+        "projectId": job.project_id,
+        "status": job.status,
+        "progress": job.progress,
+        "result": json.loads(job.result_json) if job.result_json else None,
+        "errorMessage": job.error_message,
+        "createdAt": job.created_at,
+        "updatedAt": job.updated_at,
+    }
+
+
+def _run_analysis_job(job_id: int, project_id: int, refresh: bool, mode: str | None = None) -> None:
+    db = SessionLocal()
+    try:
+        job = db.query(PipelineTask).get(job_id)
+        job.status = "InProgress"
+        db.add(job)
+        db.commit()
+        try:
+            result = _analyze_core(project_id, db, refresh=refresh, mode=mode)
+        except Exception as exc:
+            db.rollback()
+            detail = exc.detail if isinstance(exc, HTTPException) else str(exc)
+            logger.warning("analysis job failed | job_id=%s project_id=%s | %s", job_id, project_id, detail)
+            job = db.query(PipelineTask).get(job_id)
+            job.status = "Failed"
+            job.error_message = str(detail)
+            db.add(job)
+            db.commit()
+            return
+        job = db.query(PipelineTask).get(job_id)
+        job.status = "Completed"
+        job.progress = 100
+        job.result_json = json.dumps(result.dict(by_alias=True), ensure_ascii=False)
+        db.add(job)
+        db.commit()
+    finally:
+        db.close()
+        key = _analysis_key(project_id, refresh, mode)
+        with _running_jobs_lock:
+            if _running_analysis_jobs.get(key) == job_id:
+                del _running_analysis_jobs[key]
+
+
+def _is_running_job(job_id: int) -> bool:
+    with _running_jobs_lock:
+        return job_id in _running_analysis_jobs.values()
+
+
+@router.post("/{project_id}")
+def analyze(
+    project_id: int,
+    refresh: bool = Query(False),
+    async_job: bool = Query(False, alias="async"),
+    mode: Optional[str] = Query(None),
+    db: Session = Depends(get_db),
+):
+    """
+    默认同步执行解析并返回 TenderAnalysis；
+    async=true 时立即返回 jobId，后台执行，通过 GET /jobs/{job_id} 查询状态与结果。
+    mode=mapreduce 时对全文分段抽取（默认取 ANALYSIS_MODE）。
+    """
+    if mode is not None and mode not in ANALYSIS_MODES:
+        raise HTTPException(status_code=400, detail=f"不支持的解析模式: {mode}")
+    key = _analysis_key(project_id, refresh, mode)
+    if not async_job:
+        # 重复点击 / 多人同时打开同一项目时共享同一次解析；跟随者不使用自己的会话
+        return _analysis_flight.do(key, lambda: _analyze_core(project_id, db, refresh=refresh, mode=mode))
+
+    if not db.query(Project.id).filter(Project.id == project_id).first():
+        raise HTTPException(status_code=404, detail="Project not found")
+    with _running_jobs_lock:
+        # 相同项目、刷新标志与解析模式的任务进行中时直接复用，避免重复的 LLM 调用
+        running_id = _running_analysis_jobs.get(key)
+        if running_id:
+            job = db.query(PipelineTask).get(running_id)
+            if job and job.status in ("Pending", "InProgress"):
+                return _job_to_dict(job)
+        job = PipelineTask(project_id=project_id, type="analysis", status="Pending", progress=0.0)
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        _running_analysis_jobs[key] = job.id
+    submit_task(_run_analysis_job, job.id, project_id, refresh, mode)
+    return _job_to_dict(job)
+
+
+@router.get("/jobs/{job_id}")
+def get_analysis_job(job_id: int, db: Session = Depends(get_db)):
+    job = (
+        db.query(PipelineTask)
+        .filter(PipelineTask.id == job_id, PipelineTask.type == "analysis")
+        .first()
+    )
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status in ("Pending", "InProgress") and not _is_running_job(job.id):
+        # 进程重启后遗留的任务不会再有人更新，结束它以免前端一直轮询
+        job.status = "Failed"
+        job.error_message = ANALYSIS_JOB_INTERRUPTED
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+    return _job_to_dict(job)
 
 
 @router.get("/{project_id}", response_model=TenderAnalysis)
-def get_analysis(project_id: int, refresh: bool = Query(False), db: Session = Depends(get_db)):
-    # 读已存在；如无则即时生成，便于前端通过 GET 直接取数。
-    return _analyze_core(project_id, db, refresh=refresh)
+def get_analysis(project_id: int, db: Session = Depends(get_db)):
+    # 纯读取：不触发 LLM；尚无结果时返回 404，由调用方 POST 发起解析
+    stored = _read_stored_analysis(db, project_id)
+    if not stored:
+        raise HTTPException(status_code=404, detail="尚未完成招标分析，请先发起解析")
+    return stored
@@ -1,14 +1,28 @@
+import hashlib
 import json
+import logging
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Iterator
 from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
 from database import SessionLocal
-from models import PipelineTask, Project
+import llm_client
+from models import ChapterCheckpoint, PipelineTask, Project
 from vector_store import search_chunks
 from tasks import submit_task
 import os
-import requests
+from .analysis import input_fingerprint, list_source_files
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
+
+# 章节并发线程数；实际同时发往 Ollama 的请求数由 llm_client 的自适应限流器决定
+CHAPTER_CONCURRENCY = int(os.getenv("CHAPTER_CONCURRENCY", str(llm_client.LLM_LIMIT_MAX)))
+CHAPTER_LLM_TIMEOUT = int(os.getenv("CHAPTER_LLM_TIMEOUT", "60"))
 
 
 def get_db():
@@ -19,48 +33,234 @@ def get_db():
         db.close()
 
 
-def _call_llm(prompt: str) -> str:
-    base = os.getenv("OLLAMA_BASE")
-    model = os.getenv("OLLAMA_MODEL", "qwen3:14B")
-    if not base:
-        raise Exception("OLLAMA_BASE not configured")
-    resp = requests.post(
-        f"{base}/api/generate",
-        json={"model": model, "prompt": prompt},
-        timeout=60,
-    )
-    resp.raise_for_status()
-    data = resp.json()
-    return data.get("response") or json.dumps(data, ensure_ascii=False)
+def _call_llm(prompt: str, refresh: bool = False) -> str:
+    return llm_client.generate(prompt, timeout=CHAPTER_LLM_TIMEOUT, site="chapter", refresh=refresh)
+
 
+def _stream_llm(prompt: str, cancel: threading.Event | None = None) -> Iterator[str]:
+    """以 Ollama stream 模式逐段产出 response 文本；cancel 置位时提前断开上游连接。"""
+    return llm_client.stream(prompt, timeout=CHAPTER_LLM_TIMEOUT, site="chapter", cancel=cancel)
 
-def _generate_chapters(project_id: int, outline: list):
+
+def _generate_one_chapter(
+    project_id: int,
+    chapter: dict,
+    on_token: Callable[[str], None] | None = None,
+    cancel: threading.Event | None = None,
+    refresh: bool = False,
+) -> dict:
+    title = chapter.get("title", "未命名章节")
+    query = chapter.get("query") or title
+    # 每个线程使用独立会话，检索完即释放连接，不在 LLM 调用期间占用
     db = SessionLocal()
     try:
-        results = []
-        for chapter in outline:
-            title = chapter.get("title", "未命名章节")
-            query = chapter.get("query") or title
-            hits = search_chunks(db, project_id, query, top_k=5)
-            citations = "\n\n".join([f"[片段{i+1}] {c[1][:400]}" for i, c in enumerate(hits)])
-            prompt = f"""你是投标书撰写专家，请撰写章节《{title}》，满足招标要求。可参考以下项目资料片段：
+        hits = search_chunks(db, project_id, query, top_k=5)
+    finally:
+        db.close()
+    citations = "\n\n".join([f"[片段{i+1}] {c[1][:400]}" for i, c in enumerate(hits)])
+    prompt = f"""你是投标书撰写专家，请撰写章节《{title}》，满足招标要求。可参考以下项目资料片段：
 {citations or "无可用片段"}
 请输出纯文本，不要包含多余的解释。"""
-            content = _call_llm(prompt)
-            results.append({"title": title, "content": content, "citations": hits})
-        return results
+    if on_token is None:
+        content = _call_llm(prompt, refresh=refresh)
+    else:
+        pieces: list[str] = []
+        for piece in _stream_llm(prompt, cancel):
+            pieces.append(piece)
+            on_token(piece)
+        content = "".join(pieces)
+    return {"title": title, "content": content, "citations": hits}
+
+
+def _outline_hash(outline: list, input_hash: str = "") -> str:
+    """checkpoint 键：outline 与项目输入文件指纹，招标文件替换后不再复用旧章节。"""
+    raw = json.dumps({"outline": outline, "input": input_hash}, ensure_ascii=False, sort_keys=True)
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _project_input_hash(project_id: int) -> str:
+    db = SessionLocal()
+    try:
+        files = list_source_files(db, project_id)
+    finally:
+        db.close()
+    return input_fingerprint(files)
+
+
+def _clear_checkpoints(project_id: int) -> None:
+    """章节全部生成成功、结果已写回任务后，删除该项目的 checkpoint。"""
+    db = SessionLocal()
+    try:
+        db.query(ChapterCheckpoint).filter(ChapterCheckpoint.project_id == project_id).delete(
+            synchronize_session=False
+        )
+        db.commit()
+    except Exception as exc:
+        db.rollback()
+        logger.warning("clear chapter checkpoints failed | project_id=%s | %s", project_id, exc)
+    finally:
+        db.close()
+
+
+def _load_checkpoints(project_id: int, outline_hash: str) -> dict[int, dict]:
+    """读取同一 outline 已完成的章节，按 outline 位置返回。"""
+    db = SessionLocal()
+    try:
+        rows = (
+            db.query(ChapterCheckpoint)
+            .filter(
+                ChapterCheckpoint.project_id == project_id,
+                ChapterCheckpoint.outline_hash == outline_hash,
+            )
+            .all()
+        )
+        return {
+            r.position: {
+                "title": r.title,
+                "content": r.content or "",
+                "citations": json.loads(r.citations_json or "[]"),
+            }
+            for r in rows
+        }
     finally:
         db.close()
 
 
+def _save_checkpoint(
+    project_id: int,
+    task_id: int | None,
+    outline_hash: str,
+    position: int,
+    result: dict,
+    progress: float | None = None,
+    overwrite: bool = False,
+) -> None:
+    """
+    章节完成即落库，同时刷新任务进度。
+    已有同位置的 checkpoint 时：overwrite（refresh 重新生成）覆盖旧内容，否则忽略（并发重提交）。
+    """
+    db = SessionLocal()
+    try:
+        row = None
+        if overwrite:
+            row = (
+                db.query(ChapterCheckpoint)
+                .filter(
+                    ChapterCheckpoint.project_id == project_id,
+                    ChapterCheckpoint.outline_hash == outline_hash,
+                    ChapterCheckpoint.position == position,
+                )
+                .first()
+            )
+        if row is None:
+            row = ChapterCheckpoint(project_id=project_id, outline_hash=outline_hash, position=position)
+        row.task_id = task_id or 0
+        row.title = result.get("title")
+        row.content = result.get("content")
+        row.citations_json = json.dumps(result.get("citations") or [], ensure_ascii=False)
+        db.add(row)
+        try:
+            db.commit()
+        except IntegrityError:
+            db.rollback()
+        if task_id and progress is not None:
+            t = db.query(PipelineTask).get(task_id)
+            if t:
+                t.status = "InProgress"
+                t.progress = progress
+                db.add(t)
+                db.commit()
+    except Exception as exc:
+        db.rollback()
+        logger.warning("save chapter checkpoint failed | project_id=%s position=%s | %s", project_id, position, exc)
+    finally:
+        db.close()
+
+
+def _generate_chapters(
+    project_id: int,
+    outline: list,
+    concurrency: int | None = None,
+    task_id: int | None = None,
+    refresh: bool = False,
+) -> list[dict]:
+    """
+    按 outline 并发生成章节，结果顺序与 outline 一致。
+    单个章节失败只记录 error，不影响其他章节；
+    已完成章节逐个写入 checkpoint，同一 outline 且输入文件未变时重新提交只补齐缺失章节；
+    refresh 时忽略已有 checkpoint 全部重新生成，并覆盖旧的 checkpoint。
+    调用方写回任务结果后，全部成功时应调用 _clear_checkpoints。
+    """
+    if not outline:
+        return []
+    outline_hash = _outline_hash(outline, _project_input_hash(project_id))
+    results: list[dict | None] = [None] * len(outline)
+    resumed = {} if refresh else _load_checkpoints(project_id, outline_hash)
+    for idx, done in resumed.items():
+        if 0 <= idx < len(outline):
+            results[idx] = done
+    pending = [idx for idx, r in enumerate(results) if r is None]
+    if len(pending) < len(outline):
+        logger.info(
+            "resume chapter generation | project_id=%s reused=%s pending=%s",
+            project_id,
+            len(outline) - len(pending),
+            len(pending),
+        )
+    if not pending:
+        return results
+
+    completed = len(outline) - len(pending)
+    workers = max(1, min(concurrency or CHAPTER_CONCURRENCY, len(pending)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = {
+            pool.submit(_generate_one_chapter, project_id, outline[idx], refresh=refresh): idx for idx in pending
+        }
+        for fut in as_completed(futures):
+            idx = futures[fut]
+            completed += 1
+            try:
+                results[idx] = fut.result()
+            except Exception as exc:
+                title = outline[idx].get("title", "未命名章节")
+                logger.warning("chapter generation failed | project_id=%s title=%s | %s", project_id, title, exc)
+                results[idx] = {"title": title, "content": "", "citations": [], "error": str(exc)}
+                continue
+            _save_checkpoint(
+                project_id,
+                task_id,
+                outline_hash,
+                idx,
+                results[idx],
+                progress=completed * 100.0 / len(outline),
+                overwrite=refresh,
+            )
+    return results
+
+
+def _sse(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _validate_outline(payload: dict) -> tuple[list, int | None]:
+    outline = payload.get("outline") or []
+    if not isinstance(outline, list) or not outline:
+        raise HTTPException(status_code=400, detail="outline 不能为空")
+    if not all(isinstance(ch, dict) for ch in outline):
+        raise HTTPException(status_code=400, detail="outline 每项必须为对象")
+    concurrency = payload.get("concurrency")
+    if concurrency is not None and (not isinstance(concurrency, int) or concurrency < 1):
+        raise HTTPException(status_code=400, detail="concurrency 必须为正整数")
+    return outline, concurrency
+
+
 @router.post("/{project_id}")
 def generate_chapters(project_id: int, payload: dict, db: Session = Depends(get_db)):
     project = db.query(Project).filter(Project.id == project_id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
-    outline = payload.get("outline") or []
-    if not isinstance(outline, list) or not outline:
-        raise HTTPException(status_code=400, detail="outline 不能为空")
+    outline, concurrency = _validate_outline(payload)
+    refresh = bool(payload.get("refresh"))
 
     task = PipelineTask(project_id=project_id, type="chapter_generation", status="Pending", progress=0.0)
     db.add(task)
@@ -68,18 +268,139 @@ def generate_chapters(project_id: int, payload: dict, db: Session = Depends(get_
     db.refresh(task)
 
     def runner():
-        result = _generate_chapters(project_id, outline)
-        db2 = SessionLocal()
         try:
-            t = db2.query(PipelineTask).get(task.id)
-            t.status = "Completed"
-            t.progress = 100
-            t.result_json = json.dumps(result, ensure_ascii=False)
-            db2.add(t)
-            db2.commit()
-        finally:
-            db2.close()
+            result = _generate_chapters(project_id, outline, concurrency, task_id=task.id, refresh=refresh)
+        except Exception as exc:
+            logger.exception("chapter generation task failed | task_id=%s", task.id)
+            _mark_task_failed(task.id, str(exc))
+            raise
+        if not _finish_chapter_task(task.id, result):
+            _clear_checkpoints(project_id)
         return result
 
     submit_task(runner)
     return {"task_id": task.id, "status": "Pending"}
+
+
+@router.post("/{project_id}/stream")
+def stream_chapters(project_id: int, payload: dict, db: Session = Depends(get_db)):
+    """
+    以 SSE 推送章节生成结果，每完成一个章节立即推送 chapter 事件；
+    payload.tokens 为 true 时额外推送逐 token 的 token 事件；
+    payload.refresh 为 true 时不复用 checkpoint，全部章节重新生成并覆盖。
+    事件顺序: start -> (token)* / chapter * N -> done
+    """
+    project = db.query(Project).filter(Project.id == project_id).first()
+    if not project:
+        raise HTTPException(status_code=404, detail="Project not found")
+    outline, concurrency = _validate_outline(payload)
+    with_tokens = bool(payload.get("tokens"))
+    refresh = bool(payload.get("refresh"))
+
+    task = PipelineTask(project_id=project_id, type="chapter_generation", status="InProgress", progress=0.0)
+    db.add(task)
+    db.commit()
+    db.refresh(task)
+    task_id = task.id
+    db.close()
+
+    outline_hash = _outline_hash(outline, _project_input_hash(project_id))
+    resumed = {} if refresh else _load_checkpoints(project_id, outline_hash)
+    events: "queue.Queue[tuple[str, dict]]" = queue.Queue()
+    cancel = threading.Event()
+
+    def work(idx: int, chapter: dict) -> None:
+        def push_token(piece: str) -> None:
+            events.put(("token", {"index": idx, "delta": piece}))
+
+        on_token = push_token if with_tokens else None
+        try:
+            result = _generate_one_chapter(project_id, chapter, on_token=on_token, cancel=cancel, refresh=refresh)
+        except llm_client.LLMCancelledError:
+            # 客户端已断开：半截正文既不推送也不写 checkpoint
+            return
+        except Exception as exc:
+            title = chapter.get("title", "未命名章节")
+            logger.warning("chapter generation failed | project_id=%s title=%s | %s", project_id, title, exc)
+            result = {"title": title, "content": "", "citations": [], "error": str(exc)}
+        else:
+            if cancel.is_set():
+                return
+            _save_checkpoint(project_id, task_id, outline_hash, idx, result, overwrite=refresh)
+        events.put(("chapter", {"index": idx, **result}))
+
+    def event_stream():
+        results: list[dict | None] = [None] * len(outline)
+        pending = [idx for idx in range(len(outline)) if idx not in resumed]
+        workers = max(1, min(concurrency or CHAPTER_CONCURRENCY, max(len(pending), 1)))
+        pool = ThreadPoolExecutor(max_workers=workers)
+        finished_task = False
+        try:
+            for idx in pending:
+                pool.submit(work, idx, outline[idx])
+            yield _sse("start", {"taskId": task_id, "total": len(outline), "resumed": len(outline) - len(pending)})
+            finished = 0
+            for idx in sorted(resumed):
+                if idx >= len(outline):
+                    continue
+                finished += 1
+                results[idx] = resumed[idx]
+                yield _sse("chapter", {"index": idx, **resumed[idx], "completed": finished, "resumed": True})
+            while finished < len(outline):
+                event, data = events.get()
+                if event == "chapter":
+                    finished += 1
+                    idx = data.pop("index")
+                    results[idx] = data
+                    data = {"index": idx, **data, "completed": finished}
+                yield _sse(event, data)
+            failed = _finish_chapter_task(task_id, results)
+            finished_task = True
+            if not failed:
+                # 结果已写回任务；有失败章节时保留 checkpoint，重新提交只补齐失败章节
+                _clear_checkpoints(project_id)
+            yield _sse("done", {"taskId": task_id, "failed": failed})
+        finally:
+            # 客户端断开时生成器被关闭：通知流式请求中止并丢弃未开始的章节
+            cancel.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+            if not finished_task:
+                # 任务未写回结果就结束（客户端断开或出错），不能停留在 InProgress
+                _mark_task_failed(task_id, "客户端断开连接，章节生成已中止")
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _finish_chapter_task(task_id: int, results: list) -> list[str]:
+    """写回章节生成结果，返回失败章节标题列表。"""
+    failed = [r["title"] for r in results if r and r.get("error")]
+    db = SessionLocal()
+    try:
+        t = db.query(PipelineTask).get(task_id)
+        if t:
+            t.status = "Completed"
+            t.progress = 100
+            t.result_json = json.dumps(results, ensure_ascii=False)
+            t.error_message = f"以下章节生成失败: {', '.join(failed)}" if failed else None
+            db.add(t)
+            db.commit()
+    finally:
+        db.close()
+    return failed
+
+
+def _mark_task_failed(task_id: int, error: str) -> None:
+    db = SessionLocal()
+    try:
+        t = db.query(PipelineTask).get(task_id)
+        if t:
+            t.status = "Failed"
+            t.error_message = error
+            db.add(t)
+            db.commit()
+    finally:
+        db.close()
@@ -1,8 +1,9 @@
+import io
 import logging
 import os
 import re
 import uuid
-from tempfile import NamedTemporaryFile
+from tempfile import SpooledTemporaryFile
 from typing import List, Dict, Any
 from fastapi import APIRouter, HTTPException
 from docx import Document
@@ -14,6 +15,13 @@ from minio_client import client, BUCKET, ensure_bucket
 router = APIRouter()
 logger = logging.getLogger(__name__)
 IMAGE_TOKEN_RE = re.compile(r"\[\[IMAGE\|([^\|\]]+)\|([^\]]*)\]\]")
+# 生成的投标书存放前缀；这类 FileRecord 不是招标输入文件
+EXPORT_PREFIX = "exports/"
+# 导出文档在内存中缓冲的上限（字节），超过后才溢出到临时文件，关闭时自动删除
+EXPORT_SPOOL_MAX_BYTES = int(os.getenv("EXPORT_SPOOL_MAX_BYTES", str(32 * 1024 * 1024)))
+# 上传分片大小（字节，MinIO 要求不小于 5MB）；文档超过该大小时分片上传
+EXPORT_PART_SIZE = max(5 * 1024 * 1024, int(os.getenv("EXPORT_PART_SIZE", str(10 * 1024 * 1024))))
+DOCX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
 
 
 def apply_styles(doc: Document):
@@ -160,20 +168,27 @@ def add_sections(doc: Document, sections: List[Dict[str, Any]]):
             return url.split("/download/", 1)[-1].lstrip("/")
         return url.lstrip("/")
 
-    def _load_image_tmp(object_name: str | None) -> str | None:
+    # 同一图片在文档中多次出现时只下载一次
+    images: dict[str, bytes | None] = {}
+
+    def _load_image(object_name: str | None) -> bytes | None:
         if not object_name:
             return None
+        if object_name in images:
+            return images[object_name]
+        data = None
+        resp = None
         try:
             resp = client.get_object(BUCKET, object_name)
-            _, ext = os.path.splitext(object_name)
-            with NamedTemporaryFile(delete=False, suffix=ext or ".img") as tmp:
-                data = resp.read()
-                tmp.write(data)
-                tmp.flush()
-                return tmp.name
+            data = resp.read()
         except Exception as exc:
             logger.warning("Load image failed | object=%s err=%s", object_name, exc)
-            return None
+        finally:
+            if resp is not None:
+                resp.close()
+                resp.release_conn()
+        images[object_name] = data
+        return data
 
     def _add_paragraph_with_images(text: str):
         """
@@ -199,23 +214,20 @@ def add_sections(doc: Document, sections: List[Dict[str, Any]]):
                 p_text.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
 
             object_name = _extract_object_name(m.group(1))
-            tmp_path = _load_image_tmp(object_name)
-            if tmp_path:
+            image_data = _load_image(object_name)
+            if image_data:
+                # 图片独立段落，基于 Normal 样式清除首行缩进、行距，固定上下间距
+                p_img = doc.add_paragraph(style="Normal")
+                p_img.alignment = WD_ALIGN_PARAGRAPH.CENTER
+                p_img.paragraph_format.first_line_indent = Pt(0)
+                p_img.paragraph_format.line_spacing_rule = WD_LINE_SPACING.SINGLE
+                p_img.paragraph_format.space_before = Pt(8)
+                p_img.paragraph_format.space_after = Pt(8)
+                run = p_img.add_run()
                 try:
-                    # 图片独立段落，基于 Normal 样式清除首行缩进、行距，固定上下间距
-                    p_img = doc.add_paragraph(style="Normal")
-                    p_img.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                    p_img.paragraph_format.first_line_indent = Pt(0)
-                    p_img.paragraph_format.line_spacing_rule = WD_LINE_SPACING.SINGLE
-                    p_img.paragraph_format.space_before = Pt(8)
-                    p_img.paragraph_format.space_after = Pt(8)
-                    run = p_img.add_run()
-                    run.add_picture(tmp_path, width=Cm(14))
-                finally:
-                    try:
-                        os.unlink(tmp_path)
-                    except Exception:
-                        pass
+                    run.add_picture(io.BytesIO(image_data), width=Cm(14))
+                except Exception as exc:
+                    logger.warning("Insert image failed | object=%s err=%s", object_name, exc)
 
             cursor = m.end()
 
@@ -282,19 +294,21 @@ def export_word(payload: dict):
                 p.alignment = WD_ALIGN_PARAGRAPH.JUSTIFY
 
     ensure_bucket()
-    object_name = f"exports/{uuid.uuid4()}.docx"
-    with NamedTemporaryFile(delete=False, suffix=".docx") as tmp:
-        doc.save(tmp.name)
-        tmp.flush()
-        file_size = os.path.getsize(tmp.name)
-        with open(tmp.name, "rb") as f:
-            client.put_object(
-                BUCKET,
-                object_name,
-                f,
-                length=file_size,
-                content_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            )
+    object_name = f"{EXPORT_PREFIX}{uuid.uuid4()}.docx"
+    # 文档直接序列化到内存缓冲（过大时才溢出到临时文件），离开 with 即释放，不在磁盘残留
+    with SpooledTemporaryFile(max_size=EXPORT_SPOOL_MAX_BYTES, suffix=".docx") as buf:
+        doc.save(buf)
+        file_size = buf.tell()
+        buf.seek(0)
+        # 超过 part_size 时 MinIO 客户端按分片流式上传
+        client.put_object(
+            BUCKET,
+            object_name,
+            buf,
+            length=file_size,
+            part_size=EXPORT_PART_SIZE,
+            content_type=DOCX_CONTENT_TYPE,
+        )
 
     return {
         "url": f"/api/files/download/{object_name}",
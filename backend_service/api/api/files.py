@@ -1,4 +1,5 @@
 
+import hashlib
 import io
 import uuid
 import os
@@ -39,8 +40,10 @@ def upload_file(
 
     ensure_bucket()
     object_name = f"{uuid.uuid4()}_{file.filename}"
-    data = io.BytesIO(file.file.read())
+    raw = file.file.read()
+    data = io.BytesIO(raw)
     size = data.getbuffer().nbytes
+    content_hash = hashlib.sha256(raw).hexdigest()
     data.seek(0)
 
     client.put_object(
@@ -58,6 +61,7 @@ def upload_file(
         object_name=object_name,
         content_type=file.content_type,
         size=size,
+        content_hash=content_hash,
     )
     db.add(record)
     db.commit()
@@ -1,10 +1,16 @@
 from datetime import datetime
+import hashlib
 import json
 import logging
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from fastapi import APIRouter, Depends, HTTPException
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from database import SessionLocal
+from database import SessionLocal, session_scope
+import llm_client
 from minio_client import client, BUCKET
 from text_parser import parse_file_bytes
 from models import (
@@ -12,12 +18,14 @@ from models import (
     Project,
     FileRecord,
     DocumentContent,
-    Material,
-    MaterialBinding,
-    DocumentChunk,
+    GeneratedSection,
     TenderAnalysis as TenderAnalysisModel,
 )
 from schemas import GenerationTaskCreate, GenerationTaskRead
+from prompt_budget import PromptPart, fit_prompt
+from tasks import submit_task
+from template_renderer import PlaceholderRenderer
+from material_resolver import load_bindings, resolve_placeholders
 import sys, os
 base_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), "..", ".."))
 if base_dir not in sys.path:
@@ -27,12 +35,26 @@ from .analysis import (
     _call_llm,
     extract_key_info_with_ollama,
     build_anythingllm_queries,
-    _query_anythingllm,
+    query_anythingllm_many,
+    list_source_files,
+    input_fingerprint,
 )
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+# 章节并发线程数；实际同时发往 Ollama 的请求数由 llm_client 的自适应限流器决定
+SECTION_CONCURRENCY = int(os.getenv("SECTION_CONCURRENCY", str(llm_client.LLM_LIMIT_MAX)))
+# 单个章节失败后的重试次数与间隔（秒）
+SECTION_RETRIES = int(os.getenv("SECTION_RETRIES", "1"))
+SECTION_RETRY_DELAY = float(os.getenv("SECTION_RETRY_DELAY", "2"))
+# 重试后仍失败的章节写入该占位正文，整份标书照常导出
+SECTION_FAILED_BODY = "（本章节内容生成失败，请在编辑页补充或重新生成。）"
+
+# 本进程内进行中的生成任务：project_id -> task_id
+_running_generations: dict[int, int] = {}
+_running_lock = threading.Lock()
+
 
 def get_db():
     db = SessionLocal()
@@ -71,8 +93,9 @@ def _build_section_prompt(
     # 使用编号列出要点，使输入更清晰
     sections_text = "\n".join([f"({i+1}) {s}" for i, s in enumerate(sections) if s])
     key_info_text = json.dumps(key_info or {}, ensure_ascii=False)
-    
-    return f"""你是一名专业的投标书撰写专家。你的任务是根据提供的所有资料，为项目「{project_name}」生成**当前章节**的正式投标书正文。
+
+    def build_prompt(sections_text: str, summary_text: str, key_info_text: str, evidence: str, kb_answer: str) -> str:
+        return f"""你是一名专业的投标书撰写专家。你的任务是根据提供的所有资料，为项目「{project_name}」生成**当前章节**的正式投标书正文。
 
     [⚠️ 严格格式要求 - 必须遵守]
     1. **只输出本章节的**正文内容**，且必须保证内容在全文中是连续的。**
@@ -87,7 +110,7 @@ def _build_section_prompt(
     [项目信息]
     项目名称: {project_name}
     章节标题: {title}
-    项目摘要 (仅供参考): {summary or "无"}
+    项目摘要 (仅供参考): {summary_text or "无"}
 
     [章节内容来源]
     章节要点 (须全部展开并整合):
@@ -97,7 +120,7 @@ def _build_section_prompt(
     {kb_answer or "无"}
 
     招标关键信息 (JSON，仅作参考):
-    {key_info_text}
+    {key_info_text or "{}"}
 
     原文/证据 (可直接吸收的关键句子):
     {evidence or "无"}
@@ -109,6 +132,19 @@ def _build_section_prompt(
     3. **结构化细化**: 如果内容丰富，请在正文内部使用**二级或三级带编号的小标题**（例如：2.1.1、2.1.2 等）来组织内容，以增强文档的专业结构感。
     4. **占位符**: 必须保留并使用占位符（如 {{material:xxx}}）在正文中适当的位置，**不得改写、删除或解释占位符本身**。"""
 
+    # 章节要点必须完整保留；其余按 摘要 > 关键信息 > 原文证据 > 知识库 的优先级截断
+    return fit_prompt(
+        build_prompt,
+        [
+            PromptPart("sections_text", sections_text, priority=0),
+            PromptPart("summary_text", summary or "", priority=1),
+            PromptPart("key_info_text", key_info_text, priority=2),
+            PromptPart("evidence", evidence or "", priority=3, min_tokens=100),
+            PromptPart("kb_answer", kb_answer or "", priority=4),
+        ],
+        label=f"section {title}",
+    )
+
 
 def _generate_section_content(
     project_name: str,
@@ -117,12 +153,97 @@ def _generate_section_content(
     kb_answer: str = "",
     key_info: dict | None = None,
     evidence: str = "",
+    refresh: bool = False,
 ) -> str:
     prompt = _build_section_prompt(project_name, summary, chapter, kb_answer, key_info, evidence)
-    resp = _call_llm(prompt)
+    resp = _call_llm(prompt, refresh=refresh, site="section")
     return str(resp).strip()
 
 
+def _generate_section_with_retry(
+    project_name: str,
+    summary: str,
+    chapter: dict,
+    kb_answer: str = "",
+    key_info: dict | None = None,
+    evidence: str = "",
+    refresh: bool = False,
+) -> str:
+    attempts = SECTION_RETRIES + 1
+    for attempt in range(1, attempts + 1):
+        try:
+            return _generate_section_content(project_name, summary, chapter, kb_answer, key_info, evidence, refresh)
+        except Exception as exc:
+            detail = exc.detail if isinstance(exc, HTTPException) else exc
+            logger.warning(
+                "section generation failed | heading=%s attempt=%s/%s | %s",
+                chapter.get("title"),
+                attempt,
+                attempts,
+                detail,
+            )
+            if attempt == attempts:
+                raise
+            time.sleep(SECTION_RETRY_DELAY)
+
+
+def _section_input_hash(chapter: dict, summary: str, key_info: dict | None, model: str) -> str:
+    """章节输入指纹：标题、要点、摘要、关键信息与模型任一变化都会触发重新生成。"""
+    raw = json.dumps(
+        {
+            "heading": chapter.get("title"),
+            "sections": chapter.get("sections") or [],
+            "summary": summary or "",
+            "key_info": key_info or {},
+            "model": model,
+        },
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _load_generated_sections(db: Session, project_id: int, hashes: list[str]) -> dict[str, str]:
+    if not hashes:
+        return {}
+    rows = (
+        db.query(GeneratedSection)
+        .filter(GeneratedSection.project_id == project_id, GeneratedSection.input_hash.in_(set(hashes)))
+        .all()
+    )
+    return {r.input_hash: r.body or "" for r in rows}
+
+
+def _save_generated_section(
+    db: Session, project_id: int, input_hash: str, heading: str, body: str, model: str
+) -> None:
+    row = (
+        db.query(GeneratedSection)
+        .filter(GeneratedSection.project_id == project_id, GeneratedSection.input_hash == input_hash)
+        .first()
+    )
+    if not row:
+        row = GeneratedSection(project_id=project_id, input_hash=input_hash)
+    row.heading = heading[:255]
+    row.body = body
+    row.model = model
+    db.add(row)
+    try:
+        db.commit()
+    except IntegrityError:
+        # 同一章节已由其他进程写入，保留先写入的结果
+        db.rollback()
+
+
+def _prune_generated_sections(db: Session, project_id: int, keep: list[str]) -> None:
+    """删除不再对应当前文档结构的章节正文。"""
+    query = db.query(GeneratedSection).filter(GeneratedSection.project_id == project_id)
+    if keep:
+        query = query.filter(GeneratedSection.input_hash.notin_(set(keep)))
+    query.delete(synchronize_session=False)
+    db.commit()
+
+
 def _clean_markdown(text: str) -> str:
     """Strip simple Markdown markers (#, *, bullets) from text."""
     if not text:
@@ -138,23 +259,123 @@ def _clean_markdown(text: str) -> str:
     return "\n".join(lines)
 
 
+def _update_task(task_id: int, **fields) -> None:
+    """每次进度更新单独开一个短事务，生成过程中不长期占用连接。"""
+    with session_scope() as db:
+        task = db.query(GenerationTask).get(task_id)
+        if not task:
+            return
+        for key, value in fields.items():
+            setattr(task, key, value)
+        task.updated_at = datetime.utcnow()
+        db.add(task)
+
+
 @router.post("/{project_id}", response_model=GenerationTaskRead)
 def start_generation(
     project_id: int, payload: GenerationTaskCreate = None, db: Session = Depends(get_db)
 ):
+    """
+    创建生成任务后立即返回，后台依次执行 解析复用/关键信息 → 知识库检索 → 章节生成 → 素材替换 → 导出，
+    前端通过 GET /{project_id}/latest 轮询 currentStage 与 progress。
+    """
     project = db.query(Project).filter(Project.id == project_id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
-
-    analysis = (
-        db.query(TenderAnalysisModel)
-        .filter(TenderAnalysisModel.project_id == project_id)
-        .order_by(TenderAnalysisModel.updated_at.desc())
-        .first()
+    has_analysis = (
+        db.query(TenderAnalysisModel.id).filter(TenderAnalysisModel.project_id == project_id).first()
     )
-    if not analysis:
+    if not has_analysis:
         raise HTTPException(status_code=400, detail="请先完成招标内容解析后再生成投标书")
 
+    refresh = bool(payload.refresh) if payload else False
+    with _running_lock:
+        # 同一项目已有进行中的生成任务时直接返回该任务，避免重复占用 LLM
+        running_id = _running_generations.get(project_id)
+        if running_id:
+            running = db.query(GenerationTask).get(running_id)
+            if running and running.status in ("Pending", "InProgress"):
+                return to_read_model(running)
+        now = datetime.utcnow()
+        task = GenerationTask(
+            project_id=project_id,
+            status="InProgress",
+            progress=0.0,
+            current_stage="Initialization",
+            status_message="任务已创建，等待执行",
+            config_id=payload.config_id if payload else None,
+            started_at=now,
+            updated_at=now,
+        )
+        db.add(task)
+        db.commit()
+        db.refresh(task)
+        _running_generations[project_id] = task.id
+    submit_task(_run_generation, task.id, project_id, refresh)
+    return to_read_model(task)
+
+
+def _run_generation(task_id: int, project_id: int, refresh: bool) -> None:
+    try:
+        try:
+            _generate_document(task_id, project_id, refresh)
+        except Exception as exc:
+            detail = exc.detail if isinstance(exc, HTTPException) else str(exc)
+            logger.exception("generation task failed | task_id=%s project_id=%s", task_id, project_id)
+            _update_task(task_id, status="Failed", status_message="生成失败", error_message=str(detail))
+    finally:
+        with _running_lock:
+            if _running_generations.get(project_id) == task_id:
+                del _running_generations[project_id]
+
+
+def fail_interrupted_generations() -> int:
+    """
+    启动钩子：上次进程退出时未结束的生成任务不会再被执行，也不在 _running_generations 中，
+    标记为 Failed，前端轮询随之结束，用户可以重新发起生成。返回处理的任务数。
+    """
+    with session_scope() as db:
+        count = (
+            db.query(GenerationTask)
+            .filter(GenerationTask.status.in_(["Pending", "InProgress"]))
+            .update(
+                {
+                    GenerationTask.status: "Failed",
+                    GenerationTask.status_message: "生成中断",
+                    GenerationTask.error_message: "服务重启，生成任务已中断，请重新生成",
+                    GenerationTask.updated_at: datetime.utcnow(),
+                },
+                synchronize_session=False,
+            )
+        )
+    if count:
+        logger.warning("marked interrupted generation tasks as failed | count=%s", count)
+    return count
+
+
+def _generate_document(task_id: int, project_id: int, refresh: bool) -> None:
+    """
+    数据库访问拆成若干短事务（读取输入 → 逐章保存 → 写回结果），
+    LLM 与知识库调用期间不持有数据库连接。
+    """
+    def stage(name: str, progress: float, message: str) -> None:
+        _update_task(task_id, current_stage=name, progress=round(progress, 1), status_message=message)
+
+    stage("Initialization", 2, "读取招标解析结果")
+    with session_scope() as db:
+        project = db.query(Project).filter(Project.id == project_id).first()
+        if not project:
+            raise HTTPException(status_code=404, detail="Project not found")
+        analysis = (
+            db.query(TenderAnalysisModel)
+            .filter(TenderAnalysisModel.project_id == project_id)
+            .order_by(TenderAnalysisModel.updated_at.desc())
+            .first()
+        )
+        if not analysis:
+            raise HTTPException(status_code=400, detail="请先完成招标内容解析后再生成投标书")
+        files = list_source_files(db, project_id)
+
     summary = analysis.summary or ""
     raw_struct = json.loads(analysis.document_structure_json or "[]")
 
@@ -176,80 +397,105 @@ def start_generation(
                 normalized.append(str(s))
         return normalized
 
-    raw_text = _load_raw_text_for_project(db, project_id, max_chars=2000)
-    key_info = extract_key_info_with_ollama(raw_text)
-    queries = build_anythingllm_queries(key_info, project.name)
-    kb_answers: list[str] = []
-    for q in queries:
-        try:
-            ans = _query_anythingllm(q)
-            if ans:
-                kb_answers.append(f"【{q}】\n{ans}")
-        except Exception as exc:
-            logger.warning("anythingllm query failed | q=%s | %s", q, exc)
+    fingerprint = input_fingerprint(files)
+    if not refresh and analysis.key_info_json is not None and analysis.input_fingerprint == fingerprint:
+        # 输入文件未变化：直接复用解析阶段保存的关键信息与知识库答案
+        stage("Analysis", 15, "复用招标解析结果")
+        logger.info("reuse analysis artifacts | project_id=%s fingerprint=%s", project_id, fingerprint[:12])
+        raw_text = analysis.raw_text_excerpt or ""
+        key_info = json.loads(analysis.key_info_json or "{}")
+        kb_answers = json.loads(analysis.kb_answers_json or "[]")
+    else:
+        stage("Analysis", 5, "提取招标关键信息")
+        raw_text = _load_raw_text(files, max_chars=2000)
+        key_info = extract_key_info_with_ollama(raw_text, refresh=refresh)
+        stage("KnowledgeRetrieval", 15, "检索知识库")
+        queries = build_anythingllm_queries(key_info, project.name)
+        kb_answers = query_anythingllm_many(queries)
     kb_answer = "\n\n".join(kb_answers)
 
-    def build_sections_with_generation(struct, summary_text: str) -> list[dict]:
-        sections = []
+    def build_sections_with_generation(struct, summary_text: str) -> tuple[list[dict], list[str]]:
+        """并发生成各章节，结果按原章节顺序排列；返回 (章节列表, 失败章节标题)。"""
+        chapters: list[dict] = []
         for ch in struct or []:
             if not isinstance(ch, dict):
                 logger.warning("skip invalid chapter item: %s", ch)
                 continue
             heading = ch.get("title") or ch.get("heading") or "章节"
-            sec_list = normalize_sections(ch.get("sections") or [])
-            evidence = raw_text[:500] if raw_text else ""
-            try:
-                body_text = _generate_section_content(
-                    project.name,
-                    summary_text,
-                    {"title": heading, "sections": sec_list},
-                    kb_answer=kb_answer,
-                    key_info=key_info,
-                    evidence=evidence,
-                )
-            except HTTPException:
-                raise
-            except Exception as exc:
-                logger.exception("生成章节失败 | project_id=%s heading=%s", project_id, heading)
-                raise HTTPException(status_code=502, detail=f"生成章节内容失败: {exc}")
-            sections.append({"heading": heading, "level": 1, "body": body_text})
+            chapters.append({"title": heading, "sections": normalize_sections(ch.get("sections") or [])})
+        evidence = raw_text[:500] if raw_text else ""
+
+        # 输入未变化的章节直接复用上次生成的正文；refresh 时全部重新生成
+        model = llm_client.default_model()
+        hashes = [_section_input_hash(c, summary_text, key_info, model) for c in chapters]
+        if refresh:
+            stored = {}
+        else:
+            with session_scope() as db:
+                stored = _load_generated_sections(db, project_id, hashes)
+        bodies: list[str] = [stored.get(h, "") for h in hashes]
+        pending = [idx for idx, h in enumerate(hashes) if h not in stored]
+        if chapters:
+            logger.info(
+                "section generation | project_id=%s total=%s reused=%s pending=%s",
+                project_id,
+                len(chapters),
+                len(chapters) - len(pending),
+                len(pending),
+            )
+        failed: list[str] = []
+        if pending:
+            total = len(pending)
+            # 章节生成占 20%~80% 的进度；进度只在当前线程写库，工作线程不碰会话
+            stage("Drafting", 20, f"生成章节 0/{total}")
+            workers = max(1, min(SECTION_CONCURRENCY, total))
+            with ThreadPoolExecutor(max_workers=workers) as pool:
+                futures = {
+                    pool.submit(
+                        _generate_section_with_retry,
+                        project.name,
+                        summary_text,
+                        chapters[idx],
+                        kb_answer,
+                        key_info,
+                        evidence,
+                        refresh,
+                    ): idx
+                    for idx in pending
+                }
+                for done, fut in enumerate(as_completed(futures), start=1):
+                    idx = futures[fut]
+                    try:
+                        bodies[idx] = fut.result()
+                    except Exception:
+                        logger.exception("生成章节失败 | project_id=%s heading=%s", project_id, chapters[idx]["title"])
+                        failed.append(chapters[idx]["title"])
+                        bodies[idx] = SECTION_FAILED_BODY
+                    else:
+                        with session_scope() as db:
+                            _save_generated_section(
+                                db, project_id, hashes[idx], chapters[idx]["title"], bodies[idx], model
+                            )
+                    stage("Drafting", 20 + 60 * done / total, f"生成章节 {done}/{total}")
+        if chapters and not failed:
+            with session_scope() as db:
+                _prune_generated_sections(db, project_id, hashes)
+
+        sections = [
+            {"heading": chapter["title"], "level": 1, "body": body} for chapter, body in zip(chapters, bodies)
+        ]
         if not sections and summary_text:
             sections.append({"heading": "概要", "level": 1, "body": summary_text})
-        return sections
+        return sections, failed
 
-    generated_sections = build_sections_with_generation(doc_struct, summary)
+    generated_sections, failed_headings = build_sections_with_generation(doc_struct, summary)
 
-    # 占位符素材替换：图片用特殊标记，文本类用解析出的正文
-    bindings = (
-        db.query(MaterialBinding)
-        .filter(MaterialBinding.project_id == project_id)
-        .all()
-    )
-    materials = {m.id: m for m in db.query(Material).all()}
-    placeholder_map: dict[str, str] = {}
-    for b in bindings:
-        mat = materials.get(b.material_id)
-        if not mat:
-            continue
-        if mat.type == "Image":
-            replacement = f"[[IMAGE|{mat.url}|{mat.name}]]"
-        else:
-            text = _material_text(db, mat)
-            replacement = text or (f"{mat.name}（{mat.url}）" if mat.url else mat.name)
-        placeholder_map[str(b.placeholder_key)] = replacement
-
-    def replace_placeholders(text: str) -> str:
-        if not text or not placeholder_map:
-            return text
-        out = text
-        for key, val in placeholder_map.items():
-            out = out.replace(f"{{{{{key}}}}}", val)
-            out = out.replace(f"{{{{ {key} }}}}", val)
-            if ":" in key:
-                short = key.split(":")[-1]
-                out = out.replace(f"{{{{{short}}}}}", val)
-                out = out.replace(f"{{{{ {short} }}}}", val)
-        return out
+    stage("Finalizing", 82, "替换素材占位符")
+
+    # 事务内只读取绑定与已入库的素材正文，MinIO 下载在归还连接之后进行
+    with session_scope() as db:
+        bindings = load_bindings(db, project_id)
+    renderer = PlaceholderRenderer(bindings.resolve())
 
     # 保留未替换占位符的正文用于前端编辑；生成替换版用于导出
     cleaned_sections: list[dict] = []
@@ -260,32 +506,15 @@ def start_generation(
         cleaned_sections.append({"heading": heading_text or "章节", "level": sec.get("level", 1), "body": body_text})
         replaced_sections.append(
             {
-                "heading": replace_placeholders(heading_text or "章节"),
+                "heading": renderer.render(heading_text or "章节"),
                 "level": sec.get("level", 1),
-                "body": replace_placeholders(body_text),
+                "body": renderer.render(body_text),
             }
         )
 
     full_content = "\n\n".join([f"{sec['heading']}\n{sec['body']}" for sec in replaced_sections])
 
-    # 保存生成结果用于前端编辑展示，保留未替换的占位符
-    doc_content = db.query(DocumentContent).filter(DocumentContent.project_id == project_id).first()
-    try:
-        existing = json.loads(doc_content.content_json) if doc_content and doc_content.content_json else {}
-    except Exception:
-        existing = {}
-    if isinstance(existing, list):
-        existing = {"content": existing, "structure": existing}
-
-    new_payload = {
-        "content": cleaned_sections,
-        "structure": existing.get("structure") or doc_struct,
-    }
-    if not doc_content:
-        doc_content = DocumentContent(project_id=project_id)
-    doc_content.content_json = json.dumps(new_payload, ensure_ascii=False)
-    db.add(doc_content)
-
+    stage("Rendering", 88, "导出 Word 文档")
     title = "投 标 文 件"
     filename = f"{project.name}.docx"
     # 封面信息
@@ -320,40 +549,55 @@ def start_generation(
     filename = export_res.get("filename") or f"{title}.docx"
     result_url = None
 
-    # 记录生成文件到 FileRecord，便于前端下载
-    if object_name:
-        file_record = FileRecord(
-            project_id=project_id,
-            filename=filename,
-            object_name=object_name,
-            content_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-            size=export_res.get("size"),
+    # 结果在一个短事务内写回：正文、导出文件记录、项目状态
+    with session_scope() as db:
+        # 保存生成结果用于前端编辑展示，保留未替换的占位符
+        doc_content = db.query(DocumentContent).filter(DocumentContent.project_id == project_id).first()
+        try:
+            existing = json.loads(doc_content.content_json) if doc_content and doc_content.content_json else {}
+        except Exception:
+            existing = {}
+        if isinstance(existing, list):
+            existing = {"content": existing, "structure": existing}
+
+        new_payload = {
+            "content": cleaned_sections,
+            "structure": existing.get("structure") or doc_struct,
+        }
+        if not doc_content:
+            doc_content = DocumentContent(project_id=project_id)
+        doc_content.content_json = json.dumps(new_payload, ensure_ascii=False)
+        db.add(doc_content)
+
+        # 记录生成文件到 FileRecord，便于前端下载
+        if object_name:
+            file_record = FileRecord(
+                project_id=project_id,
+                filename=filename,
+                object_name=object_name,
+                content_type="application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+                size=export_res.get("size"),
+            )
+            db.add(file_record)
+            db.flush()
+            result_url = f"/api/files/{file_record.id}/download"
+            logger.info("Stored generated doc | project_id=%s file_id=%s object=%s url=%s", project_id, file_record.id, object_name, result_url)
+
+        db.query(Project).filter(Project.id == project_id).update(
+            {Project.status: "Completed", Project.updated_at: datetime.utcnow()}, synchronize_session=False
         )
-        db.add(file_record)
-        db.commit()
-        db.refresh(file_record)
-        result_url = f"/api/files/{file_record.id}/download"
-        logger.info("Stored generated doc | project_id=%s file_id=%s object=%s url=%s", project_id, file_record.id, object_name, result_url)
-
-    task = GenerationTask(
-        project_id=project_id,
+    _update_task(
+        task_id,
         status="Completed",
         progress=100.0,
         current_stage="Completed",
-        status_message="生成完成",
+        status_message=_with_unresolved(
+            f"生成完成，{len(failed_headings)} 个章节生成失败需补充" if failed_headings else "生成完成",
+            renderer,
+        ),
+        error_message=("生成失败的章节: " + "、".join(failed_headings)) if failed_headings else None,
         result_url=result_url,
-        config_id=payload.config_id if payload else None,
-        started_at=datetime.utcnow(),
-        updated_at=datetime.utcnow(),
     )
-    project.status = "Completed"
-
-    project.updated_at = datetime.utcnow()
-    db.add(task)
-    db.add(project)
-    db.commit()
-    db.refresh(task)
-    return to_read_model(task)
 
 
 @router.post("/{project_id}/export_current", response_model=GenerationTaskRead)
@@ -385,41 +629,11 @@ def export_current(project_id: int, db: Session = Depends(get_db)):
 
     generated_sections = as_sections(content_items)
 
-    # 占位符替换：图片用特殊标记，文本类用解析出的正文
-    bindings = (
-        db.query(MaterialBinding)
-        .filter(MaterialBinding.project_id == project_id)
-        .all()
-    )
-    materials = {m.id: m for m in db.query(Material).all()}
-    placeholder_map: dict[str, str] = {}
-    for b in bindings:
-        mat = materials.get(b.material_id)
-        if not mat:
-            continue
-        if mat.type == "Image":
-            replacement = f"[[IMAGE|{mat.url}|{mat.name}]]"
-        else:
-            text = _material_text(db, mat)
-            replacement = text or (f"{mat.name}（{mat.url}）" if mat.url else mat.name)
-        placeholder_map[str(b.placeholder_key)] = replacement
-
-    def replace_placeholders(text: str) -> str:
-        if not text or not placeholder_map:
-            return text
-        out = text
-        for key, val in placeholder_map.items():
-            out = out.replace(f"{{{{{key}}}}}", val)
-            out = out.replace(f"{{{{ {key} }}}}", val)
-            if ":" in key:
-                short = key.split(":")[-1]
-                out = out.replace(f"{{{{{short}}}}}", val)
-                out = out.replace(f"{{{{ {short} }}}}", val)
-        return out
+    renderer = _placeholder_renderer(db, project_id)
 
     for sec in generated_sections:
-        sec["body"] = replace_placeholders(sec.get("body") or "")
-        sec["heading"] = replace_placeholders(sec.get("heading") or "章节")
+        sec["body"] = renderer.render(sec.get("body") or "")
+        sec["heading"] = renderer.render(sec.get("heading") or "章节")
 
     full_content = "\n\n".join([f"{sec['heading']}\n{sec['body']}" for sec in generated_sections])
 
@@ -474,7 +688,7 @@ def export_current(project_id: int, db: Session = Depends(get_db)):
         status="Completed",
         progress=100.0,
         current_stage="Completed",
-        status_message="导出完成",
+        status_message=_with_unresolved("导出完成", renderer),
         result_url=result_url,
         config_id=None,
         started_at=datetime.utcnow(),
@@ -563,52 +777,22 @@ def complete_task(project_id: int, task_id: int, db: Session = Depends(get_db)):
     db.commit()
     db.refresh(task)
     return to_read_model(task)
-def _material_text(db: Session, material: Material) -> str | None:
-    """Load parsed text for a material from DocumentChunk, fallback to on-the-fly parse."""
-    chunks = (
-        db.query(DocumentChunk)
-        .filter(DocumentChunk.file_id == material.id)
-        .order_by(DocumentChunk.chunk_index.asc())
-        .all()
-    )
-    if not chunks:
-        text_chunks = []
-    else:
-        text_chunks = [c.content or "" for c in chunks]
-    text = "\n".join(text_chunks).strip() if text_chunks else ""
-    if text:
-        return text
 
-    # Fallback: download from MinIO and parse
-    def _extract_object_name(url: str | None) -> str | None:
-        if not url:
-            return None
-        if "/download/" in url:
-            return url.split("/download/", 1)[-1].lstrip("/")
-        return url.lstrip("/")
-
-    object_name = _extract_object_name(material.url)
-    if not object_name:
-        return None
-    try:
-        resp = client.get_object(BUCKET, object_name)
-        data = resp.read()
-        parsed = parse_file_bytes(material.name or object_name, data)
-        text = "\n".join(parsed).strip()
-        return text or None
-    except Exception:
-        logger.warning("Parse material text failed | material_id=%s object=%s", material.id, object_name)
-    text = "\n".join([c.content or "" for c in chunks]).strip()
-    return text or None
 
+def _placeholder_renderer(db: Session, project_id: int) -> PlaceholderRenderer:
+    """按项目的素材绑定构建占位符渲染器（素材正文经 material_resolver 批量解析并缓存）。"""
+    return PlaceholderRenderer(resolve_placeholders(db, project_id))
 
-def _load_raw_text_for_project(db: Session, project_id: int, max_chars: int = 2000) -> str:
-    files = (
-        db.query(FileRecord)
-        .filter(FileRecord.project_id == project_id)
-        .order_by(FileRecord.created_at.desc())
-        .all()
-    )
+
+def _with_unresolved(message: str, renderer: PlaceholderRenderer) -> str:
+    if not renderer.unresolved:
+        return message
+    names = sorted(renderer.unresolved)
+    logger.warning("unresolved placeholders | %s", names)
+    return f"{message}；未绑定素材的占位符: " + "、".join(names)
+
+
+def _load_raw_text(files: list[FileRecord], max_chars: int = 2000) -> str:
     snippets: list[str] = []
     budget = max_chars
     for f in files:
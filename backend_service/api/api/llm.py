@@ -1,13 +1,81 @@
 
-from fastapi import APIRouter
-import requests, os
+from fastapi import APIRouter, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
+import llm_client
+import llm_metrics
+import llm_warmup
+import singleflight
+from llm_cache import llm_cache
 
 router = APIRouter()
 
+
+def _http_error(exc: llm_client.LLMError) -> HTTPException:
+    if isinstance(exc, llm_client.LLMConfigError):
+        return HTTPException(status_code=500, detail=str(exc))
+    if isinstance(exc, llm_client.LLMOverloadedError):
+        return HTTPException(status_code=503, detail="LLM 服务繁忙，请稍后重试")
+    if isinstance(exc, llm_client.LLMTimeoutError):
+        return HTTPException(status_code=504, detail="LLM请求超时")
+    return HTTPException(status_code=502, detail=f"LLM 请求失败: {exc}")
+
+
 @router.post("/infer")
 def infer(prompt: str):
-    r = requests.post(
-        f"{os.getenv('OLLAMA_BASE')}/api/generate",
-        json={"model": os.getenv("OLLAMA_MODEL"), "prompt": prompt}
-    )
-    return r.json()
+    try:
+        return llm_client.generate_raw(prompt, site="infer")
+    except llm_client.LLMError as exc:
+        raise _http_error(exc)
+
+
+@router.post("/infer/stream")
+async def infer_stream(prompt: str, request: Request):
+    """
+    异步透传 Ollama 的 NDJSON 流：每生成一段即下发一行，最后一行含 done 与计时字段。
+    首行到达前的错误以 HTTP 状态码返回；客户端断开时关闭上游连接，Ollama 随之停止生成。
+    """
+    upstream = llm_client.astream(prompt, site="infer")
+    try:
+        first = await upstream.__anext__()
+    except StopAsyncIteration:
+        first = b""
+    except llm_client.LLMError as exc:
+        raise _http_error(exc)
+
+    async def body():
+        try:
+            if first:
+                yield first
+            async for line in upstream:
+                if await request.is_disconnected():
+                    break
+                yield line
+        finally:
+            await upstream.aclose()
+
+    return StreamingResponse(body(), media_type="application/x-ndjson")
+
+
+@router.get("/metrics")
+def metrics(recent: int = Query(20, ge=0, le=llm_metrics.LLM_METRICS_RECENT)):
+    """calls 为按调用点/模型聚合的 Ollama 计时统计，recent 为最近调用明细条数。"""
+    return {
+        "calls": llm_metrics.snapshot(recent),
+        "cache": llm_cache.stats(),
+        "singleflight": singleflight.stats(),
+        "backends": llm_client.backend_stats(),
+        "limiter": llm_client.limiter.stats(),
+        "warmup": llm_warmup.status(),
+    }
+
+
+@router.delete("/metrics")
+def reset_metrics():
+    llm_metrics.reset()
+    return {"ok": True}
+
+
+@router.post("/warmup")
+def warmup():
+    """手动预加载模型（如刚重启 Ollama 后），返回各后端的加载结果。"""
+    return llm_warmup.warm_up()
@@ -1,3 +1,4 @@
+import hashlib
 import io
 import os
 import uuid
@@ -69,7 +70,8 @@ def upload_material(file: UploadFile, db: Session = Depends(get_db)):
 
     ensure_bucket()
     object_name = f"materials/{uuid.uuid4()}_{file.filename}"
-    data = io.BytesIO(file.file.read())
+    raw = file.file.read()
+    data = io.BytesIO(raw)
     size = data.getbuffer().nbytes
     data.seek(0)
 
@@ -89,6 +91,7 @@ def upload_material(file: UploadFile, db: Session = Depends(get_db)):
         url=f"/api/files/download/{object_name}",
         thumbnail_url=None,
         icon_name=_guess_icon(file.filename, file.content_type),
+        content_hash=hashlib.sha256(raw).hexdigest(),
     )
     db.add(mat)
     db.commit()
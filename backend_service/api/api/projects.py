@@ -3,7 +3,7 @@ from datetime import datetime
 from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from database import SessionLocal
-from models import Project
+from models import ChapterCheckpoint, Project
 from schemas import ProjectCreate, ProjectRead, ProjectUpdate
 
 router = APIRouter()
@@ -84,6 +84,9 @@ def delete_project(project_id: int, db: Session = Depends(get_db)):
     project = db.query(Project).filter(Project.id == project_id).first()
     if not project:
         raise HTTPException(status_code=404, detail="Project not found")
+    db.query(ChapterCheckpoint).filter(ChapterCheckpoint.project_id == project_id).delete(
+        synchronize_session=False
+    )
     db.delete(project)
     db.commit()
     return {"success": True}
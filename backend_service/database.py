@@ -1,4 +1,6 @@
 
+from contextlib import contextmanager
+
 from sqlalchemy import create_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 import os
@@ -11,6 +13,37 @@ except Exception:
     pass
 
 DATABASE_URL = os.getenv("MYSQL_URL")
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+# 连接池耗尽时等待空闲连接的秒数；调小后请求快速失败并返回 503，而不是一直挂起
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", "10"))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", "3600"))
+
+engine = create_engine(
+    DATABASE_URL,
+    pool_pre_ping=True,
+    pool_size=DB_POOL_SIZE,
+    max_overflow=DB_MAX_OVERFLOW,
+    pool_timeout=DB_POOL_TIMEOUT,
+    pool_recycle=DB_POOL_RECYCLE,
+)
 SessionLocal = sessionmaker(bind=engine)
 Base = declarative_base()
+
+
+@contextmanager
+def session_scope():
+    """
+    短事务会话：退出时提交并归还连接，异常时回滚。
+    用于长时间 LLM 流程中的读写片段，连接占用只覆盖实际的数据库操作。
+    提交后不过期对象，块内查出的对象退出后仍可读取已加载的字段（不能再延迟加载关联）。
+    """
+    db = SessionLocal(expire_on_commit=False)
+    try:
+        yield db
+        db.commit()
+    except Exception:
+        db.rollback()
+        raise
+    finally:
+        db.close()
@@ -0,0 +1,187 @@
+"""
+LLM 响应缓存：以 (model, prompt, options) 的 sha256 作为键。
+- 内存层：进程内 LRU，容量 LLM_CACHE_MEMORY_SIZE
+- 持久层：llm_cache 表，行数上限 LLM_CACHE_DB_MAX_ROWS
+两层共用 TTL（LLM_CACHE_TTL 秒），refresh=True 时跳过读取但仍写入新结果。
+调用方可传入 validate，只有校验通过的响应才写入缓存（如只缓存完整的 JSON 对象）。
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Callable
+
+from database import SessionLocal
+from models import LLMCacheEntry
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_ENABLED = os.getenv("LLM_CACHE_ENABLED", "1").lower() not in ("0", "false", "no")
+LLM_CACHE_TTL = int(os.getenv("LLM_CACHE_TTL", str(7 * 24 * 3600)))
+LLM_CACHE_MEMORY_SIZE = int(os.getenv("LLM_CACHE_MEMORY_SIZE", "256"))
+LLM_CACHE_DB_MAX_ROWS = int(os.getenv("LLM_CACHE_DB_MAX_ROWS", "5000"))
+# 超过该长度的响应不缓存，避免单条记录撑爆内存/表
+LLM_CACHE_MAX_ENTRY_CHARS = int(os.getenv("LLM_CACHE_MAX_ENTRY_CHARS", "200000"))
+# 每写入多少条执行一次持久层清理
+_PRUNE_EVERY = 100
+
+
+def make_key(model: str, prompt: str, options: dict | None = None) -> str:
+    raw = json.dumps(
+        {"model": model, "prompt": prompt, "options": options or {}},
+        ensure_ascii=False,
+        sort_keys=True,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    def __init__(self, memory_size: int, ttl: int, db_max_rows: int):
+        self.memory_size = memory_size
+        self.ttl = ttl
+        self.db_max_rows = db_max_rows
+        self._memory: "OrderedDict[str, tuple[float, str]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stores = 0
+        self._stats = {"memory_hits": 0, "db_hits": 0, "misses": 0, "bypass": 0, "stores": 0, "errors": 0}
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+    def _memory_get(self, key: str) -> str | None:
+        with self._lock:
+            item = self._memory.get(key)
+            if not item:
+                return None
+            stored_at, value = item
+            if time.time() - stored_at > self.ttl:
+                del self._memory[key]
+                return None
+            self._memory.move_to_end(key)
+            return value
+
+    def _memory_set(self, key: str, value: str, stored_at: float | None = None) -> None:
+        with self._lock:
+            self._memory[key] = (stored_at or time.time(), value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.memory_size:
+                self._memory.popitem(last=False)
+
+    def get(self, key: str) -> str | None:
+        value = self._memory_get(key)
+        if value is not None:
+            self._count("memory_hits")
+            return value
+        db = SessionLocal()
+        try:
+            row = db.query(LLMCacheEntry).filter(LLMCacheEntry.cache_key == key).first()
+            if row and row.created_at:
+                created = row.created_at.replace(tzinfo=None)
+                if datetime.utcnow() - created <= timedelta(seconds=self.ttl):
+                    self._memory_set(key, row.response, stored_at=created.replace(tzinfo=timezone.utc).timestamp())
+                    self._count("db_hits")
+                    return row.response
+        except Exception as exc:
+            self._count("errors")
+            logger.warning("llm cache read failed | key=%s | %s", key, exc)
+        finally:
+            db.close()
+        self._count("misses")
+        return None
+
+    def set(self, key: str, model: str, value: str) -> None:
+        if not value or len(value) > LLM_CACHE_MAX_ENTRY_CHARS:
+            return
+        self._memory_set(key, value)
+        db = SessionLocal()
+        try:
+            row = db.query(LLMCacheEntry).filter(LLMCacheEntry.cache_key == key).first()
+            if not row:
+                row = LLMCacheEntry(cache_key=key)
+            row.model = model
+            row.response = value
+            row.created_at = datetime.utcnow()
+            db.add(row)
+            db.commit()
+            self._count("stores")
+        except Exception as exc:
+            db.rollback()
+            self._count("errors")
+            logger.warning("llm cache write failed | key=%s | %s", key, exc)
+        finally:
+            db.close()
+        with self._lock:
+            self._stores += 1
+            should_prune = self._stores % _PRUNE_EVERY == 0
+        if should_prune:
+            self.prune()
+
+    def prune(self) -> None:
+        """删除过期记录，并将持久层行数压到上限以内（先删最旧）。"""
+        db = SessionLocal()
+        try:
+            cutoff = datetime.utcnow() - timedelta(seconds=self.ttl)
+            db.query(LLMCacheEntry).filter(LLMCacheEntry.created_at < cutoff).delete(synchronize_session=False)
+            total = db.query(LLMCacheEntry).count()
+            overflow = total - self.db_max_rows
+            if overflow > 0:
+                stale_ids = [
+                    r.id
+                    for r in db.query(LLMCacheEntry.id).order_by(LLMCacheEntry.created_at.asc()).limit(overflow)
+                ]
+                db.query(LLMCacheEntry).filter(LLMCacheEntry.id.in_(stale_ids)).delete(synchronize_session=False)
+            db.commit()
+        except Exception as exc:
+            db.rollback()
+            logger.warning("llm cache prune failed | %s", exc)
+        finally:
+            db.close()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        hits = stats["memory_hits"] + stats["db_hits"]
+        lookups = hits + stats["misses"]
+        stats["hit_rate"] = round(hits / lookups, 4) if lookups else 0.0
+        stats["enabled"] = LLM_CACHE_ENABLED
+        stats["ttl"] = self.ttl
+        return stats
+
+
+llm_cache = LLMResponseCache(LLM_CACHE_MEMORY_SIZE, LLM_CACHE_TTL, LLM_CACHE_DB_MAX_ROWS)
+
+
+def cached_call(
+    model: str,
+    prompt: str,
+    fn: Callable[[], str],
+    options: dict | None = None,
+    refresh: bool = False,
+    validate: Callable[[str], bool] | None = None,
+) -> str:
+    """命中缓存直接返回，否则调用 fn 并写入缓存；refresh=True 跳过读取，validate 不通过时不写入。"""
+    if not LLM_CACHE_ENABLED:
+        return fn()
+    key = make_key(model, prompt, options)
+    if refresh:
+        llm_cache._count("bypass")
+    else:
+        cached = llm_cache.get(key)
+        # 早先写入的未校验条目同样要通过校验，不通过则视为未命中并被新结果覆盖
+        if cached is not None and (validate is None or validate(cached)):
+            logger.info("llm cache hit | model=%s key=%s", model, key[:12])
+            return cached
+    value = fn()
+    if not isinstance(value, str):
+        return value
+    if validate is not None and not validate(value):
+        logger.warning("llm response failed validation, not cached | model=%s key=%s", model, key[:12])
+        return value
+    llm_cache.set(key, model, value)
+    return value
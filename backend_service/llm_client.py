@@ -0,0 +1,783 @@
+"""
+Ollama 统一客户端：
+- 进程级 requests.Session 连接池，keep-alive 复用 TCP 连接
+- 每次调用可单独指定超时
+- 统一的响应解析（非流式 / 流式 / 流式 JSON 提前终止）
+- 调用完成后触发指标钩子（add_hook），钩子异常不影响调用
+- 相同请求的并发调用经单飞合并，只向 Ollama 发送一次
+- 多后端路由（OLLAMA_BASES）：按 在途请求数/权重 选择最空闲的后端，
+  连续失败的后端暂时摘除，冷却后放行一次探测请求，成功即恢复
+- 自适应并发限制（AIMD）：所有生成请求先取得并发槽位，上限随延迟/超时自动调整
+- astream：基于 httpx.AsyncClient 的异步 NDJSON 透传，供流式接口使用
+- 所有请求携带 keep_alive（OLLAMA_KEEP_ALIVE），模型在空闲期间保持常驻
+错误统一抛出 LLMError / LLMTimeoutError，由调用方决定如何转换为 HTTP 错误。
+"""
+import asyncio
+import json
+import logging
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import AsyncIterator, Callable, Iterator
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+
+from adaptive_limiter import AdaptiveLimiter, LimiterRejected
+from llm_cache import cached_call, make_key
+from prompt_budget import LLM_CONTEXT_TOKENS
+from singleflight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+OLLAMA_TIMEOUT = int(os.getenv("OLLAMA_TIMEOUT", "300"))
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "16"))
+# 连续失败多少次后摘除后端，摘除后多少秒放行探测请求
+OLLAMA_FAIL_THRESHOLD = int(os.getenv("OLLAMA_FAIL_THRESHOLD", "3"))
+OLLAMA_BACKEND_COOLDOWN = float(os.getenv("OLLAMA_BACKEND_COOLDOWN", "30"))
+# 模型常驻时长，如 "30m"、"2h"，-1 表示永久；留空则使用 Ollama 默认（5 分钟）
+OLLAMA_KEEP_ALIVE = os.getenv("OLLAMA_KEEP_ALIVE", "30m").strip()
+# 自适应并发上限（所有后端合计）、排队长度与排队等待时限
+LLM_LIMIT_INITIAL = int(os.getenv("LLM_LIMIT_INITIAL", "4"))
+LLM_LIMIT_MIN = int(os.getenv("LLM_LIMIT_MIN", "1"))
+LLM_LIMIT_MAX = int(os.getenv("LLM_LIMIT_MAX", "16"))
+LLM_LIMIT_MAX_QUEUE = int(os.getenv("LLM_LIMIT_MAX_QUEUE", "64"))
+LLM_LIMIT_QUEUE_TIMEOUT = float(os.getenv("LLM_LIMIT_QUEUE_TIMEOUT", "300"))
+DEFAULT_MODEL = "qwen3:14B"
+
+
+class LLMError(Exception):
+    pass
+
+
+class LLMTimeoutError(LLMError):
+    pass
+
+
+class LLMConfigError(LLMError):
+    pass
+
+
+class LLMOverloadedError(LLMError):
+    """并发槽位排队已满或等待超时。"""
+
+
+class LLMCancelledError(LLMError):
+    """调用方通过 cancel 中止了流式调用，已产出的内容不完整。"""
+
+
+_session: requests.Session | None = None
+_session_lock = threading.Lock()
+_async_client: httpx.AsyncClient | None = None
+_hooks: list[Callable[[dict], None]] = []
+_flight = SingleFlight("llm")
+limiter = AdaptiveLimiter(
+    LLM_LIMIT_INITIAL, LLM_LIMIT_MIN, LLM_LIMIT_MAX, LLM_LIMIT_MAX_QUEUE, LLM_LIMIT_QUEUE_TIMEOUT
+)
+
+
+def get_session() -> requests.Session:
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=4, pool_maxsize=OLLAMA_POOL_SIZE)
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                _session = session
+    return _session
+
+
+def get_async_client() -> httpx.AsyncClient:
+    """事件循环内共享的异步连接池；仅在异步接口中调用。"""
+    global _async_client
+    if _async_client is None:
+        _async_client = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=OLLAMA_POOL_SIZE, max_keepalive_connections=OLLAMA_POOL_SIZE)
+        )
+    return _async_client
+
+
+async def aclose() -> None:
+    global _async_client
+    if _async_client is not None:
+        await _async_client.aclose()
+        _async_client = None
+
+
+def add_hook(fn: Callable[[dict], None]) -> None:
+    """注册调用完成钩子，参数为本次调用的记录（site/model/elapsed/ok/meta 等）。"""
+    _hooks.append(fn)
+
+
+def _emit(record: dict) -> None:
+    for hook in list(_hooks):
+        try:
+            hook(record)
+        except Exception as exc:
+            logger.warning("llm hook failed | %s", exc)
+
+
+def default_model() -> str:
+    return os.getenv("OLLAMA_MODEL", DEFAULT_MODEL)
+
+
+class Backend:
+    def __init__(self, url: str, weight: float = 1.0):
+        self.url = url
+        self.weight = weight
+        self.in_flight = 0
+        self.failures = 0  # 连续失败次数
+        self.unhealthy_until = 0.0
+        self.probing = False
+        self.requests = 0
+        self.errors = 0
+
+    def available(self, now: float) -> bool:
+        # 健康，或冷却已过且当前没有探测请求在途
+        return self.unhealthy_until <= now and not self.probing
+
+    def load(self) -> float:
+        return (self.in_flight + 1) / self.weight
+
+
+_backends: list[Backend] | None = None
+_backend_lock = threading.Lock()
+
+
+def _parse_backends(raw: str) -> list[Backend]:
+    """解析 "url|权重,url" 形式的后端列表，权重缺省为 1。"""
+    backends = []
+    for item in raw.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        url, _, weight = item.partition("|")
+        try:
+            w = float(weight) if weight else 1.0
+        except ValueError:
+            raise LLMConfigError(f"invalid backend weight: {item}")
+        backends.append(Backend(url.strip().rstrip("/"), max(w, 0.01)))
+    return backends
+
+
+def backends() -> list[Backend]:
+    """OLLAMA_BASES 优先；未配置时退回单个 OLLAMA_BASE。"""
+    global _backends
+    if _backends is None:
+        with _backend_lock:
+            if _backends is None:
+                parsed = _parse_backends(os.getenv("OLLAMA_BASES") or os.getenv("OLLAMA_BASE") or "")
+                if not parsed:
+                    raise LLMConfigError("OLLAMA_BASE not configured")
+                _backends = parsed
+    return _backends
+
+
+def _acquire_backend(exclude: set[str] | None = None) -> Backend:
+    """选择 在途数/权重 最小的可用后端；全部摘除时选最早恢复的一个。"""
+    pool = [b for b in backends() if not exclude or b.url not in exclude] or backends()
+    now = time.monotonic()
+    with _backend_lock:
+        candidates = [b for b in pool if b.available(now)]
+        if candidates:
+            lowest = min(b.load() for b in candidates)
+            chosen = random.choice([b for b in candidates if b.load() == lowest])
+        else:
+            chosen = min(pool, key=lambda b: b.unhealthy_until)
+        if chosen.unhealthy_until:
+            # 冷却后的首个请求即探测；成功则恢复，失败则重新摘除
+            chosen.probing = True
+        chosen.in_flight += 1
+        chosen.requests += 1
+    return chosen
+
+
+def _release_backend(backend: Backend, ok: bool) -> None:
+    with _backend_lock:
+        backend.in_flight -= 1
+        if ok:
+            if backend.unhealthy_until:
+                logger.info("llm backend recovered | %s", backend.url)
+            backend.failures = 0
+            backend.unhealthy_until = 0.0
+        else:
+            backend.errors += 1
+            backend.failures += 1
+            if backend.probing or backend.failures >= OLLAMA_FAIL_THRESHOLD:
+                backend.unhealthy_until = time.monotonic() + OLLAMA_BACKEND_COOLDOWN
+                logger.warning(
+                    "llm backend marked unhealthy | %s failures=%s cooldown=%ss",
+                    backend.url,
+                    backend.failures,
+                    OLLAMA_BACKEND_COOLDOWN,
+                )
+        backend.probing = False
+
+
+def backend_stats() -> list[dict]:
+    try:
+        items = backends()
+    except LLMConfigError:
+        return []
+    now = time.monotonic()
+    with _backend_lock:
+        return [
+            {
+                "url": b.url,
+                "weight": b.weight,
+                "healthy": b.unhealthy_until <= now,
+                "in_flight": b.in_flight,
+                "requests": b.requests,
+                "errors": b.errors,
+                "consecutive_failures": b.failures,
+            }
+            for b in items
+        ]
+
+
+def _options(options: dict | None) -> dict:
+    # 默认显式设置上下文窗口，与提示词预算一致
+    return {"num_ctx": LLM_CONTEXT_TOKENS, **(options or {})}
+
+
+def _keep_alive() -> str | int | None:
+    if not OLLAMA_KEEP_ALIVE:
+        return None
+    try:
+        return int(OLLAMA_KEEP_ALIVE)
+    except ValueError:
+        return OLLAMA_KEEP_ALIVE
+
+
+def _meta(data: dict) -> dict:
+    """Ollama 最终响应中除正文/上下文外的字段（计时、token 数等）。"""
+    return {k: v for k, v in data.items() if k not in ("response", "context", "thinking")}
+
+
+def parse_response(resp: requests.Response) -> tuple[str, dict]:
+    """
+    解析非流式响应，返回 (文本, 原始 JSON)。
+    优先整体 JSON；失败时逐行尝试；仍失败则返回原始文本。
+    """
+    try:
+        data = resp.json()
+    except Exception:
+        data = None
+        for line in (l for l in resp.text.splitlines() if l.strip()):
+            try:
+                data = json.loads(line)
+                break
+            except Exception:
+                continue
+        if not data:
+            logger.warning("LLM 原始文本预览（非 JSON）: %s", (resp.text or "")[:400])
+            return resp.text, {}
+    text = data.get("response") or data.get("message") or json.dumps(data, ensure_ascii=False)
+    return text, data
+
+
+class JsonObjectScanner:
+    """
+    增量扫描流式输出，识别首个完整的顶层 JSON 对象。
+    跳过 <think>...</think> 段；遇到无法解析的 {...}（如正文里的占位符）则继续向后找。
+    """
+
+    _THINK_OPEN = "<think>"
+    _THINK_CLOSE = "</think>"
+
+    def __init__(self):
+        self.buffer = ""
+        self._pos = 0
+        self._start = -1
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+        self._in_think = False
+
+    def feed(self, chunk: str) -> str | None:
+        """追加一段文本；若已得到完整 JSON 对象则返回其文本。"""
+        self.buffer += chunk
+        buf = self.buffer
+        while self._pos < len(buf):
+            if self._start < 0:
+                if self._in_think:
+                    end = buf.find(self._THINK_CLOSE, self._pos)
+                    if end < 0:
+                        self._pos = max(self._pos, len(buf) - len(self._THINK_CLOSE) + 1)
+                        return None
+                    self._in_think = False
+                    self._pos = end + len(self._THINK_CLOSE)
+                    continue
+                rest = buf[self._pos : self._pos + len(self._THINK_OPEN)]
+                if rest == self._THINK_OPEN:
+                    self._in_think = True
+                    self._pos += len(self._THINK_OPEN)
+                    continue
+                if rest[:1] == "<" and self._THINK_OPEN.startswith(rest):
+                    # 可能是被截断的 <think>，等待后续文本
+                    return None
+                if buf[self._pos] == "{":
+                    self._start = self._pos
+                    self._depth = 0
+                    self._in_string = False
+                    self._escape = False
+                else:
+                    self._pos += 1
+                    continue
+
+            ch = buf[self._pos]
+            self._pos += 1
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif ch == "\\":
+                    self._escape = True
+                elif ch == '"':
+                    self._in_string = False
+                continue
+            if ch == '"':
+                self._in_string = True
+            elif ch == "{":
+                self._depth += 1
+            elif ch == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    candidate = buf[self._start : self._pos]
+                    try:
+                        json.loads(candidate)
+                        return candidate
+                    except ValueError:
+                        self._pos = self._start + 1
+                        self._start = -1
+        return None
+
+
+
+@contextmanager
+def _post(
+    payload: dict, timeout: float, stream: bool = False, site: str = "default"
+) -> Iterator[requests.Response]:
+    """
+    取得并发槽位后选择后端发送请求，槽位与在途计数都覆盖整个响应读取过程。
+    连接失败时换一个后端重试；超时、连接错误与 5xx 计为后端失败，并触发限流器回退。
+    延迟按 site 计入限流器，只与同一调用点的历史延迟比较。
+    """
+    keep_alive = _keep_alive()
+    if keep_alive is not None:
+        payload = {**payload, "keep_alive": keep_alive}
+    try:
+        limiter.acquire()
+    except LimiterRejected as exc:
+        raise LLMOverloadedError(str(exc)) from exc
+    started = time.monotonic()
+    outcome = "ignore"
+    try:
+        tried: set[str] = set()
+        while True:
+            backend = _acquire_backend(tried)
+            tried.add(backend.url)
+            ok = False
+            try:
+                try:
+                    resp = get_session().post(
+                        f"{backend.url}/api/generate", json=payload, timeout=timeout, stream=stream
+                    )
+                    resp.raise_for_status()
+                except requests.exceptions.ConnectionError as exc:
+                    if len(tried) < len(backends()):
+                        logger.warning("llm backend unreachable, retrying elsewhere | %s | %s", backend.url, exc)
+                        continue
+                    raise LLMError(str(exc)) from exc
+                except requests.exceptions.Timeout as exc:
+                    raise LLMTimeoutError(str(exc)) from exc
+                except requests.exceptions.HTTPError as exc:
+                    # 4xx 是请求本身的问题（如模型不存在），不影响后端健康状态
+                    ok = exc.response is not None and exc.response.status_code < 500
+                    raise LLMError(str(exc)) from exc
+                except requests.exceptions.RequestException as exc:
+                    raise LLMError(str(exc)) from exc
+                try:
+                    with resp:
+                        yield resp
+                except (requests.exceptions.ConnectionError, requests.exceptions.Timeout):
+                    # 流式读取过程中断开或超时，由调用方转换为 LLMError
+                    raise
+                except BaseException:
+                    # 调用方中途停止读取（GeneratorExit）或响应内容报错，不算后端故障
+                    ok = True
+                    raise
+                ok = True
+                outcome = "ok"
+                return
+            finally:
+                _release_backend(backend, ok)
+                if not ok:
+                    outcome = "dropped"
+    finally:
+        limiter.release(time.monotonic() - started, outcome, site)
+
+
+def preload(model: str, timeout: float | None = None) -> dict[str, str]:
+    """
+    在每个后端上加载模型（空提示词只加载不生成）并刷新 keep_alive。
+    options 与正式调用一致（_options 的 num_ctx），否则 Ollama 会以默认上下文加载，
+    首个正式请求因 num_ctx 不同而重新加载模型。
+    不经路由与健康统计，逐个后端直连；返回 {后端: "ok" 或错误信息}。
+    """
+    payload: dict = {"model": model, "prompt": "", "stream": False, "options": _options(None)}
+    keep_alive = _keep_alive()
+    if keep_alive is not None:
+        payload["keep_alive"] = keep_alive
+    results: dict[str, str] = {}
+    for backend in backends():
+        started = time.monotonic()
+        try:
+            resp = get_session().post(f"{backend.url}/api/generate", json=payload, timeout=timeout or OLLAMA_TIMEOUT)
+            resp.raise_for_status()
+            results[backend.url] = "ok"
+            try:
+                load_seconds = (resp.json().get("load_duration") or 0) / 1e9
+            except ValueError:
+                load_seconds = 0.0
+            # 保活请求的 load 应接近 0；持续偏大说明模型被以不同参数重新加载
+            logger.info(
+                "llm preload | backend=%s model=%s elapsed=%.2fs load=%.2fs",
+                backend.url,
+                model,
+                time.monotonic() - started,
+                load_seconds,
+            )
+        except requests.exceptions.RequestException as exc:
+            results[backend.url] = str(exc)
+            logger.warning("llm preload failed | backend=%s model=%s | %s", backend.url, model, exc)
+    return results
+
+
+def generate_raw(
+    prompt: str,
+    *,
+    model: str | None = None,
+    options: dict | None = None,
+    timeout: float | None = None,
+    site: str = "default",
+) -> dict:
+    """非流式调用，返回 Ollama 完整 JSON（不经缓存）。"""
+    model = model or default_model()
+    started = time.monotonic()
+    record = {"site": site, "model": model, "prompt_chars": len(prompt), "stream": False}
+    try:
+        with _post(
+            {"model": model, "prompt": prompt, "stream": False, "options": _options(options)},
+            timeout or OLLAMA_TIMEOUT,
+            site=site,
+        ) as resp:
+            _, data = parse_response(resp)
+    except Exception as exc:
+        _emit({**record, "ok": False, "error": str(exc), "elapsed": time.monotonic() - started})
+        raise
+    _emit({**record, "ok": True, "elapsed": time.monotonic() - started, "meta": _meta(data)})
+    return data
+
+
+def generate(
+    prompt: str,
+    *,
+    model: str | None = None,
+    options: dict | None = None,
+    timeout: float | None = None,
+    site: str = "default",
+    refresh: bool = False,
+    validate: Callable[[str], bool] | None = None,
+) -> str:
+    """非流式调用并返回文本，经响应缓存；refresh=True 跳过缓存读取，validate 不通过的响应不缓存。"""
+    model = model or default_model()
+    options = _options(options)
+
+    def _request() -> str:
+        started = time.monotonic()
+        record = {"site": site, "model": model, "prompt_chars": len(prompt), "stream": False}
+        try:
+            with _post(
+                {"model": model, "prompt": prompt, "stream": False, "options": options},
+                timeout or OLLAMA_TIMEOUT,
+                site=site,
+            ) as resp:
+                text, data = parse_response(resp)
+        except Exception as exc:
+            _emit({**record, "ok": False, "error": str(exc), "elapsed": time.monotonic() - started})
+            raise
+        _emit({**record, "ok": True, "elapsed": time.monotonic() - started, "meta": _meta(data)})
+        return text
+
+    return _coalesced(model, prompt, options, refresh, _request, validate)
+
+
+def _coalesced(
+    model: str,
+    prompt: str,
+    options: dict,
+    refresh: bool,
+    request: Callable[[], str],
+    validate: Callable[[str], bool] | None = None,
+) -> str:
+    """缓存 + 单飞：同键并发调用共享一次请求；refresh 调用只与 refresh 调用合并。"""
+    key = make_key(model, prompt, options) + (":refresh" if refresh else "")
+    return _flight.do(
+        key, lambda: cached_call(model, prompt, request, options=options, refresh=refresh, validate=validate)
+    )
+
+
+def is_json_object(text: str) -> bool:
+    """text 是否恰好是一个 JSON 对象；用于只缓存完整的 JSON 响应。"""
+    try:
+        return isinstance(json.loads(text), dict)
+    except ValueError:
+        return False
+
+
+def _iter_stream(resp: requests.Response) -> Iterator[dict]:
+    for line in resp.iter_lines():
+        if not line:
+            continue
+        data = json.loads(line)
+        if data.get("error"):
+            raise LLMError(data["error"])
+        yield data
+
+
+def stream(
+    prompt: str,
+    *,
+    model: str | None = None,
+    options: dict | None = None,
+    timeout: float | None = None,
+    site: str = "default",
+    cancel: threading.Event | None = None,
+) -> Iterator[str]:
+    """
+    流式调用，逐段产出 response 文本；cancel 置位或调用方停止迭代时断开上游连接。
+    cancel 置位时抛出 LLMCancelledError，调用方不会把半截输出当作完整结果。
+    """
+    model = model or default_model()
+    started = time.monotonic()
+    ttft: float | None = None
+    record = {"site": site, "model": model, "prompt_chars": len(prompt), "stream": True}
+    meta: dict = {}
+    try:
+        with _post(
+            {"model": model, "prompt": prompt, "stream": True, "options": _options(options)},
+            timeout or OLLAMA_TIMEOUT,
+            stream=True,
+            site=site,
+        ) as resp:
+            for data in _iter_stream(resp):
+                if cancel is not None and cancel.is_set():
+                    raise LLMCancelledError("stream cancelled")
+                piece = data.get("response")
+                if ttft is None and (piece or data.get("thinking")):
+                    ttft = time.monotonic() - started
+                if piece:
+                    yield piece
+                if data.get("done"):
+                    meta = _meta(data)
+                    break
+    except LLMCancelledError:
+        # 主动取消不是调用失败，不计入指标
+        raise
+    except requests.exceptions.RequestException as exc:
+        _emit({**record, "ok": False, "error": str(exc), "elapsed": time.monotonic() - started, "ttft": ttft})
+        raise LLMError(str(exc)) from exc
+    except Exception as exc:
+        _emit({**record, "ok": False, "error": str(exc), "elapsed": time.monotonic() - started, "ttft": ttft})
+        raise
+    _emit({**record, "ok": True, "elapsed": time.monotonic() - started, "ttft": ttft, "meta": meta})
+
+
+def generate_json(
+    prompt: str,
+    *,
+    model: str | None = None,
+    options: dict | None = None,
+    timeout: float | None = None,
+    site: str = "default",
+    refresh: bool = False,
+) -> str:
+    """
+    流式调用，首个完整 JSON 对象到达即关闭连接（Ollama 随之中止生成），
+    返回该对象文本；未得到完整对象时返回全部输出。记录首 token 延迟（TTFT）。
+    只有完整的 JSON 对象写入响应缓存，截断或格式错误的输出下次会重新生成。
+    """
+    model = model or default_model()
+    options = _options(options)
+
+    def _request() -> str:
+        scanner = JsonObjectScanner()
+        started = time.monotonic()
+        ttft: float | None = None
+        early_stop = False
+        json_text: str | None = None
+        meta: dict = {}
+        record = {"site": site, "model": model, "prompt_chars": len(prompt), "stream": True}
+        try:
+            with _post(
+                {"model": model, "prompt": prompt, "stream": True, "options": options},
+                timeout or OLLAMA_TIMEOUT,
+                stream=True,
+                site=site,
+            ) as resp:
+                for data in _iter_stream(resp):
+                    piece = data.get("response") or ""
+                    if ttft is None and (piece or data.get("thinking")):
+                        ttft = time.monotonic() - started
+                    if piece:
+                        json_text = scanner.feed(piece)
+                    if data.get("done"):
+                        meta = _meta(data)
+                    if json_text is not None:
+                        early_stop = not data.get("done")
+                        break
+                    if data.get("done"):
+                        break
+        except requests.exceptions.Timeout as exc:
+            _emit({**record, "ok": False, "error": str(exc), "elapsed": time.monotonic() - started, "ttft": ttft})
+            raise LLMTimeoutError(str(exc)) from exc
+        except requests.exceptions.RequestException as exc:
+            _emit({**record, "ok": False, "error": str(exc), "elapsed": time.monotonic() - started, "ttft": ttft})
+            raise LLMError(str(exc)) from exc
+        except Exception as exc:
+            _emit({**record, "ok": False, "error": str(exc), "elapsed": time.monotonic() - started, "ttft": ttft})
+            raise
+        elapsed = time.monotonic() - started
+        logger.info(
+            "llm json stream | site=%s model=%s ttft=%s total=%.2fs chars=%s early_stop=%s",
+            site,
+            model,
+            f"{ttft:.2f}s" if ttft is not None else "-",
+            elapsed,
+            len(scanner.buffer),
+            early_stop,
+        )
+        _emit({**record, "ok": True, "elapsed": elapsed, "ttft": ttft, "early_stop": early_stop, "meta": meta})
+        return json_text if json_text is not None else scanner.buffer
+
+    return _coalesced(model, prompt, {**options, "stream": "json"}, refresh, _request, is_json_object)
+
+
+async def _acquire_slot() -> None:
+    """
+    在线程中排队等待并发槽位，避免阻塞事件循环。
+    线程里的 acquire 无法中断：等待期间协程被取消时，线程之后取得的槽位立即归还。
+    """
+    acquiring = asyncio.ensure_future(asyncio.to_thread(limiter.acquire))
+    try:
+        await asyncio.shield(acquiring)
+    except asyncio.CancelledError:
+        def _give_back(fut: asyncio.Future) -> None:
+            if not fut.cancelled() and fut.exception() is None:
+                limiter.release(None, "ignore")
+
+        acquiring.add_done_callback(_give_back)
+        raise
+
+
+async def astream(
+    prompt: str,
+    *,
+    model: str | None = None,
+    options: dict | None = None,
+    timeout: float | None = None,
+    site: str = "default",
+) -> AsyncIterator[bytes]:
+    """
+    异步流式调用，逐行原样产出 Ollama 的 NDJSON（含 done 行的计时字段）。
+    与同步调用共用后端路由和限流器；调用方停止迭代（客户端断开）时关闭上游连接，Ollama 随之中止生成。
+    """
+    model = model or default_model()
+    payload: dict = {"model": model, "prompt": prompt, "stream": True, "options": _options(options)}
+    keep_alive = _keep_alive()
+    if keep_alive is not None:
+        payload["keep_alive"] = keep_alive
+    record = {"site": site, "model": model, "prompt_chars": len(prompt), "stream": True}
+    try:
+        await _acquire_slot()
+    except LimiterRejected as exc:
+        raise LLMOverloadedError(str(exc)) from exc
+    started = time.monotonic()
+    ttft: float | None = None
+    meta: dict = {}
+    outcome = "ignore"
+    try:
+        tried: set[str] = set()
+        while True:
+            backend = _acquire_backend(tried)
+            tried.add(backend.url)
+            ok = False
+            try:
+                request = get_async_client().build_request(
+                    "POST",
+                    f"{backend.url}/api/generate",
+                    json=payload,
+                    timeout=httpx.Timeout(timeout or OLLAMA_TIMEOUT, connect=10.0),
+                )
+                try:
+                    resp = await get_async_client().send(request, stream=True)
+                    resp.raise_for_status()
+                except httpx.ConnectError as exc:
+                    if len(tried) < len(backends()):
+                        logger.warning("llm backend unreachable, retrying elsewhere | %s | %s", backend.url, exc)
+                        continue
+                    raise LLMError(str(exc)) from exc
+                except httpx.TimeoutException as exc:
+                    raise LLMTimeoutError(str(exc)) from exc
+                except httpx.HTTPStatusError as exc:
+                    ok = exc.response.status_code < 500
+                    await exc.response.aclose()
+                    raise LLMError(str(exc)) from exc
+                except httpx.HTTPError as exc:
+                    raise LLMError(str(exc)) from exc
+                try:
+                    async for line in resp.aiter_lines():
+                        if not line.strip():
+                            continue
+                        try:
+                            data = json.loads(line)
+                        except ValueError:
+                            data = {}
+                        if ttft is None and (data.get("response") or data.get("thinking")):
+                            ttft = time.monotonic() - started
+                        if data.get("done"):
+                            meta = _meta(data)
+                        yield (line + "\n").encode("utf-8")
+                except httpx.TimeoutException as exc:
+                    raise LLMTimeoutError(str(exc)) from exc
+                except httpx.HTTPError as exc:
+                    raise LLMError(str(exc)) from exc
+                except BaseException:
+                    # 客户端断开（GeneratorExit / CancelledError），不算后端故障
+                    ok = True
+                    raise
+                finally:
+                    await resp.aclose()
+                ok = True
+                outcome = "ok"
+                return
+            finally:
+                _release_backend(backend, ok)
+                if not ok:
+                    outcome = "dropped"
+    except (GeneratorExit, asyncio.CancelledError):
+        # 客户端断开不是调用失败，不计入指标
+        raise
+    except BaseException as exc:
+        _emit({**record, "ok": False, "error": str(exc) or type(exc).__name__, "elapsed": time.monotonic() - started, "ttft": ttft})
+        raise
+    finally:
+        elapsed = time.monotonic() - started
+        limiter.release(elapsed, outcome, site)
+        if outcome == "ok":
+            _emit({**record, "ok": True, "elapsed": elapsed, "ttft": ttft, "meta": meta})
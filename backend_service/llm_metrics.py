@@ -0,0 +1,152 @@
+"""
+LLM 调用性能统计：通过 llm_client 钩子收集每次调用的 Ollama 计时字段
+（prompt_eval_count / eval_count / prompt_eval_duration / eval_duration / load_duration），
+按 (调用点, 模型) 聚合出生成速度、提示词处理占比等，供 /api/llm/metrics 查看 GPU 时间花在哪里。
+命中缓存的调用不产生记录。
+"""
+import logging
+import os
+import threading
+from collections import deque
+
+import llm_client
+
+logger = logging.getLogger(__name__)
+
+# 保留最近多少条明细记录
+LLM_METRICS_RECENT = int(os.getenv("LLM_METRICS_RECENT", "200"))
+
+_NS = 1e9
+# 正式调用的 load_duration 超过该秒数视为冷加载（预热后应为 0）
+COLD_LOAD_SECONDS = 1.0
+_TIMING_FIELDS = (
+    "prompt_eval_count",
+    "eval_count",
+    "prompt_eval_duration",
+    "eval_duration",
+    "load_duration",
+    "total_duration",
+)
+
+_lock = threading.Lock()
+_aggregates: dict[tuple[str, str], dict] = {}
+_recent: deque = deque(maxlen=LLM_METRICS_RECENT)
+
+
+def _empty() -> dict:
+    return {
+        "calls": 0,
+        "errors": 0,
+        "early_stops": 0,
+        "timed_calls": 0,  # 带 Ollama 计时字段的调用（流式提前断开的调用没有）
+        "prompt_chars": 0,
+        "elapsed": 0.0,
+        "ttft_sum": 0.0,
+        "ttft_calls": 0,
+        "cold_loads": 0,
+        **{f: 0 for f in _TIMING_FIELDS},
+    }
+
+
+def record(rec: dict) -> None:
+    meta = rec.get("meta") or {}
+    timings = {f: int(meta.get(f) or 0) for f in _TIMING_FIELDS}
+    key = (rec.get("site") or "default", rec.get("model") or "")
+    with _lock:
+        agg = _aggregates.setdefault(key, _empty())
+        agg["calls"] += 1
+        agg["prompt_chars"] += rec.get("prompt_chars") or 0
+        agg["elapsed"] += rec.get("elapsed") or 0.0
+        if not rec.get("ok"):
+            agg["errors"] += 1
+        if rec.get("early_stop"):
+            agg["early_stops"] += 1
+        if rec.get("ttft") is not None:
+            agg["ttft_sum"] += rec["ttft"]
+            agg["ttft_calls"] += 1
+        if timings["load_duration"] / _NS > COLD_LOAD_SECONDS:
+            agg["cold_loads"] += 1
+        if timings["eval_count"] or timings["prompt_eval_count"]:
+            agg["timed_calls"] += 1
+            for f, v in timings.items():
+                agg[f] += v
+        _recent.append(
+            {
+                "site": key[0],
+                "model": key[1],
+                "ok": bool(rec.get("ok")),
+                "prompt_chars": rec.get("prompt_chars"),
+                "elapsed": round(rec.get("elapsed") or 0.0, 3),
+                "ttft": round(rec["ttft"], 3) if rec.get("ttft") is not None else None,
+                **{f: v for f, v in timings.items() if v},
+            }
+        )
+    if timings["load_duration"] / _NS > COLD_LOAD_SECONDS:
+        logger.warning(
+            "llm cold load | site=%s model=%s load=%.2fs（检查预热是否开启、num_ctx 是否与正式调用一致）",
+            key[0],
+            key[1],
+            timings["load_duration"] / _NS,
+        )
+    if timings["eval_duration"]:
+        logger.info(
+            "llm call | site=%s model=%s prompt_chars=%s prompt_tokens=%s output_tokens=%s "
+            "prompt_eval=%.2fs eval=%.2fs load=%.2fs tok/s=%.1f",
+            key[0],
+            key[1],
+            rec.get("prompt_chars"),
+            timings["prompt_eval_count"],
+            timings["eval_count"],
+            timings["prompt_eval_duration"] / _NS,
+            timings["eval_duration"] / _NS,
+            timings["load_duration"] / _NS,
+            timings["eval_count"] / (timings["eval_duration"] / _NS),
+        )
+
+
+def _rate(count: int, duration_ns: int) -> float | None:
+    return round(count / (duration_ns / _NS), 2) if duration_ns else None
+
+
+def _summarize(site: str, model: str, agg: dict) -> dict:
+    gpu_ns = agg["prompt_eval_duration"] + agg["eval_duration"]
+    return {
+        "site": site,
+        "model": model,
+        "calls": agg["calls"],
+        "errors": agg["errors"],
+        "early_stops": agg["early_stops"],
+        "timed_calls": agg["timed_calls"],
+        "cold_loads": agg["cold_loads"],
+        "avg_prompt_chars": round(agg["prompt_chars"] / agg["calls"]) if agg["calls"] else 0,
+        "avg_elapsed": round(agg["elapsed"] / agg["calls"], 3) if agg["calls"] else None,
+        "avg_ttft": round(agg["ttft_sum"] / agg["ttft_calls"], 3) if agg["ttft_calls"] else None,
+        "prompt_tokens": agg["prompt_eval_count"],
+        "output_tokens": agg["eval_count"],
+        "prompt_tokens_per_sec": _rate(agg["prompt_eval_count"], agg["prompt_eval_duration"]),
+        "output_tokens_per_sec": _rate(agg["eval_count"], agg["eval_duration"]),
+        # 提示词处理在 GPU 计算时间中的占比，高说明提示词过长
+        "prompt_eval_share": round(agg["prompt_eval_duration"] / gpu_ns, 4) if gpu_ns else None,
+        "gpu_seconds": round(gpu_ns / _NS, 2),
+        "load_seconds": round(agg["load_duration"] / _NS, 2),
+    }
+
+
+def snapshot(recent: int = 20) -> dict:
+    with _lock:
+        items = [_summarize(site, model, dict(agg)) for (site, model), agg in _aggregates.items()]
+        latest = list(_recent)[-recent:] if recent > 0 else []
+    items.sort(key=lambda x: x["gpu_seconds"], reverse=True)
+    total_gpu = sum(i["gpu_seconds"] for i in items)
+    for item in items:
+        item["gpu_share"] = round(item["gpu_seconds"] / total_gpu, 4) if total_gpu else None
+    return {"by_site": items, "recent": latest}
+
+
+def reset() -> None:
+    with _lock:
+        _aggregates.clear()
+        _recent.clear()
+
+
+llm_client.add_hook(record)
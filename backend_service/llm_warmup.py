@@ -0,0 +1,97 @@
+"""
+模型预热与保活：
+- 启动时（OLLAMA_WARMUP=1）在后台预加载 OLLAMA_WARMUP_MODELS，避免首个用户请求承担模型加载耗时
+- 工作时段内（OLLAMA_WARMUP_HOURS）每 OLLAMA_WARMUP_INTERVAL 秒重新预加载一次，
+  刷新 keep_alive，使模型在空闲期间保持常驻
+"""
+import logging
+import os
+import threading
+from datetime import datetime
+
+import llm_client
+from tasks import submit_task
+
+logger = logging.getLogger(__name__)
+
+OLLAMA_WARMUP = os.getenv("OLLAMA_WARMUP", "0").lower() not in ("0", "false", "no")
+# 逗号分隔；留空时使用 OLLAMA_MODEL
+OLLAMA_WARMUP_MODELS = os.getenv("OLLAMA_WARMUP_MODELS", "")
+# 保活间隔应小于 OLLAMA_KEEP_ALIVE，0 表示只在启动时预热一次
+OLLAMA_WARMUP_INTERVAL = int(os.getenv("OLLAMA_WARMUP_INTERVAL", "600"))
+# 工作时段（本地时间，左闭右开），如 "8-20"；留空表示全天
+OLLAMA_WARMUP_HOURS = os.getenv("OLLAMA_WARMUP_HOURS", "8-20")
+
+_stop = threading.Event()
+_thread: threading.Thread | None = None
+_last_run: dict = {}
+
+
+def warmup_models() -> list[str]:
+    models = [m.strip() for m in OLLAMA_WARMUP_MODELS.split(",") if m.strip()]
+    return models or [llm_client.default_model()]
+
+
+def in_business_hours(now: datetime | None = None) -> bool:
+    if not OLLAMA_WARMUP_HOURS.strip():
+        return True
+    try:
+        start, end = (int(x) for x in OLLAMA_WARMUP_HOURS.split("-", 1))
+    except ValueError:
+        logger.warning("invalid OLLAMA_WARMUP_HOURS=%s, treating as all day", OLLAMA_WARMUP_HOURS)
+        return True
+    hour = (now or datetime.now()).hour
+    if start <= end:
+        return start <= hour < end
+    # 跨午夜，如 "20-6"
+    return hour >= start or hour < end
+
+
+def warm_up() -> dict:
+    """在所有后端上预加载配置的模型，返回 {模型: {后端: 结果}}。"""
+    results = {}
+    for model in warmup_models():
+        try:
+            results[model] = llm_client.preload(model)
+        except llm_client.LLMConfigError as exc:
+            logger.warning("llm warmup skipped | %s", exc)
+            break
+    _last_run.update({"at": datetime.now().isoformat(timespec="seconds"), "results": results})
+    return results
+
+
+def _keepalive_loop() -> None:
+    while not _stop.wait(OLLAMA_WARMUP_INTERVAL):
+        if in_business_hours():
+            warm_up()
+
+
+def start() -> None:
+    """启动钩子：后台预热一次；配置了间隔时再启动保活线程。未启用时不做任何事。"""
+    global _thread
+    if not OLLAMA_WARMUP:
+        return
+    logger.info("llm warmup enabled | models=%s interval=%ss", warmup_models(), OLLAMA_WARMUP_INTERVAL)
+    # 首次预热交给后台任务执行器，不阻塞服务启动
+    submit_task(warm_up)
+    if OLLAMA_WARMUP_INTERVAL > 0 and _thread is None:
+        _stop.clear()
+        _thread = threading.Thread(target=_keepalive_loop, name="llm-keepalive", daemon=True)
+        _thread.start()
+
+
+def stop() -> None:
+    global _thread
+    _stop.set()
+    _thread = None
+
+
+def status() -> dict:
+    return {
+        "enabled": OLLAMA_WARMUP,
+        "models": warmup_models(),
+        "interval": OLLAMA_WARMUP_INTERVAL,
+        "hours": OLLAMA_WARMUP_HOURS,
+        "keep_alive": llm_client.OLLAMA_KEEP_ALIVE,
+        "last_run": dict(_last_run),
+    }
@@ -1,6 +1,8 @@
 
-from fastapi import FastAPI
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import JSONResponse
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from api import (
     projects,
     files,
@@ -15,6 +17,8 @@ from api import (
     document,
 )
 from database import Base, engine
+import llm_client
+import llm_warmup
 
 Base.metadata.create_all(bind=engine)
 
@@ -29,6 +33,35 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.exception_handler(PoolTimeoutError)
+def db_pool_exhausted(request: Request, exc: PoolTimeoutError):
+    # 等待数据库连接超过 DB_POOL_TIMEOUT：快速返回 503，由前端稍后重试
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "数据库连接繁忙，请稍后重试"},
+        headers={"Retry-After": "5"},
+    )
+
+
+@app.on_event("startup")
+def fail_interrupted_generations():
+    # 重启前未完成的生成任务已无人执行，结束它们以免前端一直轮询
+    generation.fail_interrupted_generations()
+
+
+@app.on_event("startup")
+def warm_up_models():
+    # OLLAMA_WARMUP=1 时后台预加载模型并在工作时段内保活
+    llm_warmup.start()
+
+
+@app.on_event("shutdown")
+async def shutdown_llm():
+    llm_warmup.stop()
+    await llm_client.aclose()
+
+
 app.include_router(projects.router, prefix="/api/projects", tags=["Projects"])
 app.include_router(files.router, prefix="/api/files", tags=["Files"])
 app.include_router(anythingllm.router, prefix="/api/anythingllm", tags=["AnythingLLM"])
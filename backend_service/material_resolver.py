@@ -0,0 +1,183 @@
+"""
+素材绑定解析：把项目的占位符绑定解析为替换文本。
+- 一次关联查询只取本项目绑定的素材
+- 素材正文按 (素材 id, 内容哈希) 缓存在进程内，重复导出不再下载、解析
+- 缓存未命中的素材先批量读取已入库的 chunk，仍缺失的并发从 MinIO 下载解析
+- load_bindings 只做数据库读取，MaterialBindings.resolve 只访问 MinIO，
+  调用方可以在两者之间结束事务，下载期间不占用数据库连接
+"""
+import logging
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from sqlalchemy.orm import Session
+
+from minio_client import BUCKET, client
+from models import DocumentChunk, Material, MaterialBinding
+from text_parser import parse_file_bytes
+
+logger = logging.getLogger(__name__)
+
+MATERIAL_TEXT_CACHE_SIZE = int(os.getenv("MATERIAL_TEXT_CACHE_SIZE", "128"))
+MATERIAL_PREFETCH_CONCURRENCY = int(os.getenv("MATERIAL_PREFETCH_CONCURRENCY", "4"))
+
+_TEXTUAL_SUFFIXES = (".pdf", ".doc", ".docx", ".txt", ".md")
+
+_cache: "OrderedDict[tuple[int, str], str]" = OrderedDict()
+_cache_lock = threading.Lock()
+
+
+def _cache_key(material: Material) -> tuple[int, str]:
+    # 旧数据没有内容哈希时退回 大小+地址，素材重新上传后地址会变化
+    return material.id, material.content_hash or f"{material.size}:{material.url}"
+
+
+def _cache_get(key: tuple[int, str]) -> str | None:
+    with _cache_lock:
+        value = _cache.get(key)
+        if value is not None:
+            _cache.move_to_end(key)
+        return value
+
+
+def _cache_set(key: tuple[int, str], value: str) -> None:
+    with _cache_lock:
+        _cache[key] = value
+        _cache.move_to_end(key)
+        while len(_cache) > MATERIAL_TEXT_CACHE_SIZE:
+            _cache.popitem(last=False)
+
+
+def _object_name(url: str | None) -> str | None:
+    if not url:
+        return None
+    if "/download/" in url:
+        return url.split("/download/", 1)[-1].lstrip("/")
+    return url.lstrip("/")
+
+
+def _is_textual(name: str | None) -> bool:
+    return (name or "").lower().endswith(_TEXTUAL_SUFFIXES)
+
+
+def _chunk_texts(db: Session, material_ids: list[int]) -> dict[int, str]:
+    """批量读取素材上传时入库的 chunk（素材 chunk 的 project_id 固定为 0）。"""
+    if not material_ids:
+        return {}
+    rows = (
+        db.query(DocumentChunk.file_id, DocumentChunk.content)
+        .filter(DocumentChunk.project_id == 0, DocumentChunk.file_id.in_(material_ids))
+        .order_by(DocumentChunk.file_id.asc(), DocumentChunk.chunk_index.asc())
+        .all()
+    )
+    parts: dict[int, list[str]] = {}
+    for file_id, content in rows:
+        parts.setdefault(file_id, []).append(content or "")
+    return {mid: "\n".join(p).strip() for mid, p in parts.items()}
+
+
+def _download_text(material_id: int, name: str | None, url: str | None) -> str:
+    """在工作线程中执行：只访问 MinIO，不使用数据库会话。"""
+    object_name = _object_name(url)
+    if not object_name:
+        return ""
+    resp = None
+    try:
+        resp = client.get_object(BUCKET, object_name)
+        data = resp.read()
+        return "\n".join(parse_file_bytes(name or object_name, data)).strip()
+    except Exception as exc:
+        logger.warning("Parse material text failed | material_id=%s object=%s | %s", material_id, object_name, exc)
+        return ""
+    finally:
+        if resp is not None:
+            resp.close()
+            resp.release_conn()
+
+
+def _local_texts(db: Session, materials: list[Material]) -> tuple[dict[int, str], list[Material]]:
+    """数据库阶段：先查进程内缓存，再批量读 chunk；返回 (已得到的正文, 需要从 MinIO 下载的素材)。"""
+    texts: dict[int, str] = {}
+    missing: list[Material] = []
+    for mat in materials:
+        cached = _cache_get(_cache_key(mat))
+        if cached is not None:
+            texts[mat.id] = cached
+        else:
+            missing.append(mat)
+
+    chunked = _chunk_texts(db, [m.id for m in missing])
+    to_download = []
+    for mat in missing:
+        text = chunked.get(mat.id)
+        if text:
+            texts[mat.id] = text
+            _cache_set(_cache_key(mat), text)
+        elif _is_textual(mat.name):
+            to_download.append(mat)
+    logger.info(
+        "material texts | total=%s cached=%s chunks=%s to_download=%s",
+        len(materials),
+        len(materials) - len(missing),
+        len(chunked),
+        len(to_download),
+    )
+    return texts, to_download
+
+
+def _download_texts(materials: list[Material]) -> dict[int, str]:
+    """MinIO 阶段：并发下载解析，不使用数据库会话。"""
+    texts: dict[int, str] = {}
+    if not materials:
+        return texts
+    workers = max(1, min(MATERIAL_PREFETCH_CONCURRENCY, len(materials)))
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        results = pool.map(lambda m: _download_text(m.id, m.name, m.url), materials)
+        for mat, text in zip(materials, results):
+            if text:
+                texts[mat.id] = text
+                _cache_set(_cache_key(mat), text)
+    return texts
+
+
+class MaterialBindings:
+    """项目的素材绑定及已在数据库阶段取得的正文；resolve 补齐下载并生成替换表。"""
+
+    def __init__(self, rows: list[tuple[str, Material]], texts: dict[int, str], to_download: list[Material]):
+        self.rows = rows
+        self.texts = texts
+        self.to_download = to_download
+
+    def resolve(self) -> dict[str, str]:
+        """占位符键 -> 替换内容：图片用特殊标记，文本类用解析出的正文，解析不到时用名称与地址。"""
+        texts = {**self.texts, **_download_texts(self.to_download)}
+        placeholder_map: dict[str, str] = {}
+        for key, mat in self.rows:
+            if mat.type == "Image":
+                replacement = f"[[IMAGE|{mat.url}|{mat.name}]]"
+            else:
+                replacement = texts.get(mat.id) or (f"{mat.name}（{mat.url}）" if mat.url else mat.name)
+            placeholder_map[str(key)] = replacement
+        return placeholder_map
+
+
+def load_bindings(db: Session, project_id: int) -> MaterialBindings:
+    """数据库阶段：一次关联查询取本项目的绑定，并读取缓存 / chunk 中已有的素材正文。"""
+    rows = (
+        db.query(MaterialBinding.placeholder_key, Material)
+        .join(Material, Material.id == MaterialBinding.material_id)
+        .filter(MaterialBinding.project_id == project_id)
+        .all()
+    )
+    if not rows:
+        return MaterialBindings([], {}, [])
+    unique = {mat.id: mat for _, mat in rows}
+    texts, to_download = _local_texts(db, [m for m in unique.values() if m.type != "Image"])
+    return MaterialBindings([(key, mat) for key, mat in rows], texts, to_download)
+
+
+def resolve_placeholders(db: Session, project_id: int) -> dict[str, str]:
+    """占位符键 -> 替换内容（同一会话内完成读取与下载）。"""
+    return load_bindings(db, project_id).resolve()
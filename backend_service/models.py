@@ -1,5 +1,5 @@
 
-from sqlalchemy import Column, Integer, String, Text, DateTime, Float
+from sqlalchemy import Column, Integer, String, Text, DateTime, Float, UniqueConstraint
 from sqlalchemy.sql import func
 from database import Base
 
@@ -23,6 +23,7 @@ class FileRecord(Base):
     object_name = Column(String(255), nullable=False, unique=True)
     content_type = Column(String(128), nullable=True)
     size = Column(Integer, nullable=True)
+    content_hash = Column(String(64), nullable=True)  # sha256 of file bytes
     created_at = Column(DateTime(timezone=True), server_default=func.now())
 
 class Material(Base):
@@ -34,6 +35,7 @@ class Material(Base):
     url = Column(String(512), nullable=False)
     thumbnail_url = Column(String(512), nullable=True)
     icon_name = Column(String(100), nullable=True)
+    content_hash = Column(String(64), nullable=True)  # sha256 of file bytes
     upload_time = Column(DateTime(timezone=True), server_default=func.now())
 
 class GenerationTask(Base):
@@ -59,6 +61,12 @@ class TenderAnalysis(Base):
     summary = Column(Text, nullable=True)
     key_dates_json = Column(Text, nullable=True)  # JSON string
     document_structure_json = Column(Text, nullable=True)  # JSON string
+    # 分析中间结果，供生成阶段复用（输入文件指纹一致时）
+    key_info_json = Column(Text, nullable=True)  # JSON string
+    kb_queries_json = Column(Text, nullable=True)  # JSON string
+    kb_answers_json = Column(Text, nullable=True)  # JSON string
+    raw_text_excerpt = Column(Text, nullable=True)
+    input_fingerprint = Column(String(64), nullable=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     updated_at = Column(
         DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
@@ -87,6 +95,38 @@ class PipelineTask(Base):
         DateTime(timezone=True), server_default=func.now(), onupdate=func.now()
     )
 
+class ChapterCheckpoint(Base):
+    __tablename__ = "chapter_checkpoints"
+    __table_args__ = (UniqueConstraint("project_id", "outline_hash", "position"),)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    project_id = Column(Integer, nullable=False)
+    task_id = Column(Integer, nullable=False)
+    outline_hash = Column(String(64), nullable=False)  # sha256 of outline JSON
+    position = Column(Integer, nullable=False)  # index within outline
+    title = Column(String(255), nullable=True)
+    content = Column(Text, nullable=True)
+    citations_json = Column(Text, nullable=True)  # JSON string
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class LLMCacheEntry(Base):
+    __tablename__ = "llm_cache"
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    cache_key = Column(String(64), nullable=False, unique=True)  # sha256(model, prompt, options)
+    model = Column(String(100), nullable=True)
+    response = Column(Text, nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
+class GeneratedSection(Base):
+    __tablename__ = "generated_sections"
+    __table_args__ = (UniqueConstraint("project_id", "input_hash"),)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    project_id = Column(Integer, nullable=False)
+    input_hash = Column(String(64), nullable=False)  # sha256(heading, sections, summary, key_info, model)
+    heading = Column(String(255), nullable=True)
+    body = Column(Text, nullable=True)
+    model = Column(String(100), nullable=True)
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+
 class DocumentContent(Base):
     __tablename__ = "document_contents"
     id = Column(Integer, primary_key=True, autoincrement=True)
@@ -0,0 +1,120 @@
+"""
+提示词预算：估算 token 数，并按优先级把上下文窗口分配给提示词的各组成部分。
+超出预算时从优先级最低的部分开始截断（保留开头），直到整体放得进
+LLM_CONTEXT_TOKENS - LLM_OUTPUT_RESERVE。
+"""
+import logging
+import math
+import os
+import re
+from dataclasses import dataclass
+from typing import Callable
+
+logger = logging.getLogger(__name__)
+
+# 与 Ollama options.num_ctx 保持一致
+LLM_CONTEXT_TOKENS = int(os.getenv("LLM_CONTEXT_TOKENS", "8192"))
+# 预留给模型输出的 token
+LLM_OUTPUT_RESERVE = int(os.getenv("LLM_OUTPUT_RESERVE", "2048"))
+
+TRUNCATED_MARK = "…(已截断)"
+
+# CJK 统一表意文字、全角标点等：约 1 字 1 token；其余字符约 4 字符 1 token
+_CJK_RE = re.compile(r"[\u3000-\u303f\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uff00-\uffef]")
+
+
+def estimate_tokens(text: str | None) -> int:
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+def _prefix_within(text: str, max_tokens: int) -> int:
+    """不超过 max_tokens 的最长前缀长度；估算值随长度单调递增，二分查找。"""
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if estimate_tokens(text[:mid]) <= max_tokens:
+            lo = mid
+        else:
+            hi = mid - 1
+    return lo
+
+
+def trim_to_tokens(text: str, max_tokens: int) -> str:
+    """保留开头，截断到不超过 max_tokens（含截断标记）。"""
+    if estimate_tokens(text) <= max_tokens:
+        return text
+    if max_tokens <= estimate_tokens(TRUNCATED_MARK):
+        return ""
+    return text[: _prefix_within(text, max_tokens - estimate_tokens(TRUNCATED_MARK))] + TRUNCATED_MARK
+
+
+def split_to_tokens(text: str, max_tokens: int) -> list[str]:
+    """按 token 上限把文本切成连续的若干段，不丢内容、不加截断标记。"""
+    pieces: list[str] = []
+    while text:
+        if estimate_tokens(text) <= max_tokens:
+            pieces.append(text)
+            break
+        cut = max(_prefix_within(text, max_tokens), 1)
+        pieces.append(text[:cut])
+        text = text[cut:]
+    return pieces
+
+
+@dataclass
+class PromptPart:
+    name: str
+    text: str
+    priority: int  # 数值越小越重要，越晚被截断
+    min_tokens: int = 0  # 截断时至少保留的 token
+
+
+def fit_prompt(
+    build: Callable[..., str],
+    parts: list[PromptPart],
+    label: str = "prompt",
+    context_tokens: int | None = None,
+    output_reserve: int | None = None,
+) -> str:
+    """
+    build 以各部分 name 为关键字参数渲染完整提示词。
+    先用空内容渲染得到模板开销，再把剩余预算按优先级分给各部分，记录最终分配。
+    """
+    context_tokens = context_tokens or LLM_CONTEXT_TOKENS
+    output_reserve = LLM_OUTPUT_RESERVE if output_reserve is None else output_reserve
+    overhead = estimate_tokens(build(**{p.name: "" for p in parts}))
+    available = max(context_tokens - output_reserve - overhead, 0)
+
+    sizes = {p.name: estimate_tokens(p.text) for p in parts}
+    texts = {p.name: p.text for p in parts}
+    overflow = sum(sizes.values()) - available
+    if overflow > 0:
+        for part in sorted(parts, key=lambda p: p.priority, reverse=True):
+            if overflow <= 0:
+                break
+            keep = max(part.min_tokens, sizes[part.name] - overflow)
+            if keep >= sizes[part.name]:
+                continue
+            texts[part.name] = trim_to_tokens(part.text, keep)
+            new_size = estimate_tokens(texts[part.name])
+            overflow -= sizes[part.name] - new_size
+            sizes[part.name] = new_size
+
+    allocation = ", ".join(
+        f"{p.name}={sizes[p.name]}" + ("(trimmed)" if texts[p.name] != p.text else "") for p in parts
+    )
+    total = overhead + sum(sizes.values())
+    log = logger.warning if total > context_tokens - output_reserve else logger.info
+    log(
+        "prompt budget %s | context=%s reserve=%s template=%s total=%s | %s",
+        label,
+        context_tokens,
+        output_reserve,
+        overhead,
+        total,
+        allocation,
+    )
+    return build(**texts)
@@ -21,10 +21,14 @@ CREATE TABLE IF NOT EXISTS files (
   object_name VARCHAR(255) NOT NULL UNIQUE,
   content_type VARCHAR(128),
   size INT,
+  content_hash VARCHAR(64),
   created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
   INDEX(project_id)
 );
 
+-- 已有库升级：
+-- ALTER TABLE files ADD COLUMN content_hash VARCHAR(64);
+
 -- Materials
 CREATE TABLE IF NOT EXISTS materials (
   id INT AUTO_INCREMENT PRIMARY KEY,
@@ -34,9 +38,13 @@ CREATE TABLE IF NOT EXISTS materials (
   url VARCHAR(512) NOT NULL,
   thumbnail_url VARCHAR(512),
   icon_name VARCHAR(100),
+  content_hash VARCHAR(64),
   upload_time DATETIME DEFAULT CURRENT_TIMESTAMP
 );
 
+-- 已有库升级：
+-- ALTER TABLE materials ADD COLUMN content_hash VARCHAR(64);
+
 -- Generation tasks
 CREATE TABLE IF NOT EXISTS generation_tasks (
   id INT AUTO_INCREMENT PRIMARY KEY,
@@ -60,11 +68,24 @@ CREATE TABLE IF NOT EXISTS tender_analysis (
   summary TEXT,
   key_dates_json TEXT,
   document_structure_json TEXT,
+  key_info_json TEXT,
+  kb_queries_json TEXT,
+  kb_answers_json LONGTEXT,
+  raw_text_excerpt TEXT,
+  input_fingerprint VARCHAR(64),
   created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
   updated_at DATETIME DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
   INDEX(project_id)
 );
 
+-- 已有库升级：
+-- ALTER TABLE tender_analysis
+--   ADD COLUMN key_info_json TEXT,
+--   ADD COLUMN kb_queries_json TEXT,
+--   ADD COLUMN kb_answers_json LONGTEXT,
+--   ADD COLUMN raw_text_excerpt TEXT,
+--   ADD COLUMN input_fingerprint VARCHAR(64);
+
 CREATE TABLE IF NOT EXISTS document_chunks (
   id INT AUTO_INCREMENT PRIMARY KEY,
   project_id INT NOT NULL,
@@ -90,6 +111,40 @@ CREATE TABLE IF NOT EXISTS pipeline_tasks (
   INDEX(type)
 );
 
+CREATE TABLE IF NOT EXISTS chapter_checkpoints (
+  id INT AUTO_INCREMENT PRIMARY KEY,
+  project_id INT NOT NULL,
+  task_id INT NOT NULL,
+  outline_hash VARCHAR(64) NOT NULL,
+  position INT NOT NULL,
+  title VARCHAR(255),
+  content LONGTEXT,
+  citations_json LONGTEXT,
+  created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+  UNIQUE KEY uq_chapter_checkpoint (project_id, outline_hash, position),
+  INDEX(task_id)
+);
+
+CREATE TABLE IF NOT EXISTS llm_cache (
+  id INT AUTO_INCREMENT PRIMARY KEY,
+  cache_key VARCHAR(64) NOT NULL UNIQUE,
+  model VARCHAR(100),
+  response LONGTEXT,
+  created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+  INDEX(created_at)
+);
+
+CREATE TABLE IF NOT EXISTS generated_sections (
+  id INT AUTO_INCREMENT PRIMARY KEY,
+  project_id INT NOT NULL,
+  input_hash VARCHAR(64) NOT NULL,
+  heading VARCHAR(255),
+  body LONGTEXT,
+  model VARCHAR(100),
+  created_at DATETIME DEFAULT CURRENT_TIMESTAMP,
+  UNIQUE KEY uq_generated_section (project_id, input_hash)
+);
+
 CREATE TABLE IF NOT EXISTS document_contents (
   id INT AUTO_INCREMENT PRIMARY KEY,
   project_id INT NOT NULL UNIQUE,
@@ -100,6 +100,8 @@ class TenderAnalysis(BaseModel):
     summary: str
     key_dates: List[dict] = Field(..., alias="keyDates")
     document_structure: List[dict] = Field(..., alias="documentStructure")
+    # 招标文件在解析之后有变化，结果需要重新解析
+    stale: bool = False
 
     class Config:
         allow_population_by_field_name = True
@@ -109,6 +111,8 @@ class TenderAnalysis(BaseModel):
 
 class GenerationTaskCreate(BaseModel):
     config_id: Optional[str] = Field(None, alias="configId")
+    # 为 True 时跳过 LLM 响应缓存，强制重新生成
+    refresh: bool = False
 
     class Config:
         allow_population_by_field_name = True
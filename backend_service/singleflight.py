@@ -0,0 +1,82 @@
+"""
+单飞（single-flight）合并：同一键的并发调用只执行一次，其余调用方等待并共享结果或异常。
+只合并“正在进行中”的调用，不缓存已完成的结果（结果缓存见 llm_cache）。
+"""
+import logging
+import os
+import threading
+from typing import Callable, TypeVar
+
+logger = logging.getLogger(__name__)
+
+SINGLEFLIGHT_ENABLED = os.getenv("SINGLEFLIGHT_ENABLED", "1").lower() not in ("0", "false", "no")
+
+T = TypeVar("T")
+
+_registry: dict[str, "SingleFlight"] = {}
+
+
+class _Call:
+    __slots__ = ("event", "result", "error", "waiters")
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result = None
+        self.error: BaseException | None = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self, name: str):
+        self.name = name
+        self._lock = threading.Lock()
+        self._calls: dict[str, _Call] = {}
+        self._stats = {"executions": 0, "shared": 0, "errors": 0}
+        _registry[name] = self
+
+    def do(self, key: str, fn: Callable[[], T]) -> T:
+        """执行 fn；若同键调用正在进行中，则等待其完成并返回同一结果（或抛出同一异常）。"""
+        if not SINGLEFLIGHT_ENABLED:
+            return fn()
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = _Call()
+                self._calls[key] = call
+                self._stats["executions"] += 1
+            else:
+                call.waiters += 1
+                self._stats["shared"] += 1
+
+        if not leader:
+            logger.info("singleflight join | group=%s key=%s", self.name, key[:12])
+            call.event.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as exc:
+            call.error = exc
+            with self._lock:
+                self._stats["errors"] += 1
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.event.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            stats = dict(self._stats)
+            stats["in_flight"] = len(self._calls)
+            stats["waiting"] = sum(c.waiters for c in self._calls.values())
+        return stats
+
+
+def stats() -> dict:
+    """所有合并组的统计，供 /api/llm/metrics 展示。"""
+    return {name: group.stats() for name, group in _registry.items()}
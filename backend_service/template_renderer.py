@@ -0,0 +1,31 @@
+"""
+占位符渲染：一次正则扫描替换正文中所有 {{key}} / {{ key }}，按字典查找替换值。
+"material:logo" 这类带前缀的键同时可用短名 {{logo}} 引用；完整键优先于短名。
+找不到绑定的占位符原样保留，并记录在 unresolved 中。
+"""
+import re
+
+PLACEHOLDER_RE = re.compile(r"\{\{\s*([^{}\s][^{}]*?)\s*\}\}")
+
+
+class PlaceholderRenderer:
+    def __init__(self, mapping: dict[str, str]):
+        lookup = {str(k).strip(): v for k, v in mapping.items()}
+        for key, value in list(lookup.items()):
+            if ":" in key:
+                lookup.setdefault(key.split(":")[-1].strip(), value)
+        self._lookup = lookup
+        self.unresolved: set[str] = set()
+
+    def _substitute(self, match: re.Match) -> str:
+        name = match.group(1)
+        value = self._lookup.get(name)
+        if value is None:
+            self.unresolved.add(name)
+            return match.group(0)
+        return value
+
+    def render(self, text: str | None) -> str | None:
+        if not text or "{{" not in text:
+            return text
+        return PLACEHOLDER_RE.sub(self._substitute, text)
@@ -1,5 +1,4 @@
 import io
-import os
 from typing import List
 from PyPDF2 import PdfReader
 from docx import Document
@@ -35,15 +34,10 @@ def parse_pdf(data: bytes) -> List[str]:
 
 
 def parse_docx(data: bytes) -> List[str]:
-    with open(".__tmp_upload.docx", "wb") as f:
-        f.write(data)
-    doc = Document(".__tmp_upload.docx")
+    # 直接从内存读取，避免并发解析时争用同一个临时文件
+    doc = Document(io.BytesIO(data))
     paras = [p.text for p in doc.paragraphs if p.text]
     full_text = "\n".join(paras)
-    try:
-        os.remove(".__tmp_upload.docx")
-    except Exception:
-        pass
     return chunk_text(full_text)
 
 
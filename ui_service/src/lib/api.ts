@@ -42,6 +42,8 @@ export interface TenderAnalysis {
   summary: string
   keyDates: Array<{ label: string; date: string }>
   documentStructure: Array<{ id: string; title: string; sections: string[] }>
+  // 招标文件在解析之后有变化，需要重新解析
+  stale?: boolean
 }
 
 const defaultHeaders = {
@@ -176,30 +178,89 @@ export async function bindMaterial(payload: { projectId: string | number; placeh
 }
 
 export async function startGeneration(projectId: string | number, configId?: string) {
+  // 接口创建任务后立即返回，生成在后台进行，进度通过 waitForGeneration 轮询
   const res = await fetch(`${API_BASE}/api/generation/${projectId}`, {
     method: 'POST',
     headers: defaultHeaders,
     body: JSON.stringify({ configId }),
   })
-  if (!res.ok) throw new Error('启动生成任务失败')
+  if (!res.ok) throw new Error(await readErrorDetail(res, '启动生成任务失败'))
   return res.json() as Promise<GenerationTask>
 }
 
-export async function fetchAnalysis(projectId: string | number, refresh: boolean = false): Promise<TenderAnalysis> {
+const isGenerationRunning = (task: GenerationTask) =>
+  !!task.taskId && (task.status === 'Pending' || task.status === 'InProgress')
+
+export async function waitForGeneration(
+  projectId: string | number,
+  onUpdate?: (task: GenerationTask) => void,
+  intervalMs: number = 2000,
+): Promise<GenerationTask> {
+  let task = await fetchLatestGenerationTask(projectId)
+  onUpdate?.(task)
+  while (isGenerationRunning(task)) {
+    await sleep(intervalMs)
+    task = await fetchLatestGenerationTask(projectId)
+    onUpdate?.(task)
+  }
+  return task
+}
+
+async function readErrorDetail(res: Response, fallback: string): Promise<string> {
+  try {
+    const data = await res.json()
+    return (data as any)?.detail || fallback
+  } catch {
+    return fallback
+  }
+}
+
+const sleep = (ms: number) => new Promise((resolve) => setTimeout(resolve, ms))
+
+export interface AnalysisJob {
+  jobId: number
+  projectId: number
+  status: string
+  progress: number
+  result?: TenderAnalysis | null
+  errorMessage?: string | null
+}
+
+export async function startAnalysisJob(projectId: string | number, refresh: boolean = false): Promise<AnalysisJob> {
   const url = new URL(`${API_BASE}/api/analysis/${projectId}`)
+  url.searchParams.set('async', 'true')
   if (refresh) url.searchParams.set('refresh', 'true')
-  const res = await fetch(url.toString())
-  if (!res.ok) {
-    let msg = '获取分析结果失败'
-    try {
-      const data = await res.json()
-      msg = (data as any)?.detail || msg
-    } catch {
-      // ignore
+  const res = await fetch(url.toString(), { method: 'POST' })
+  if (!res.ok) throw new Error(await readErrorDetail(res, '启动招标分析失败'))
+  return res.json()
+}
+
+export async function fetchAnalysisJob(jobId: string | number): Promise<AnalysisJob> {
+  const res = await fetch(`${API_BASE}/api/analysis/jobs/${jobId}`)
+  if (!res.ok) throw new Error(await readErrorDetail(res, '获取分析任务失败'))
+  return res.json()
+}
+
+export async function fetchAnalysis(projectId: string | number, refresh: boolean = false): Promise<TenderAnalysis> {
+  // GET 仅读取已有结果；无结果、结果已过期（招标文件有变化）或需要刷新时发起后台解析并轮询任务
+  if (!refresh) {
+    const res = await fetch(`${API_BASE}/api/analysis/${projectId}`)
+    if (res.ok) {
+      const stored: TenderAnalysis = await res.json()
+      if (!stored.stale) return stored
+    } else if (res.status !== 404) {
+      throw new Error(await readErrorDetail(res, '获取分析结果失败'))
     }
-    throw new Error(msg)
   }
-  return res.json()
+  let job = await startAnalysisJob(projectId, refresh)
+  while (job.status === 'Pending' || job.status === 'InProgress') {
+    await sleep(2000)
+    job = await fetchAnalysisJob(job.jobId)
+  }
+  if (job.status !== 'Completed' || !job.result) {
+    throw new Error(job.errorMessage || '获取分析结果失败')
+  }
+  return job.result
 }
 
 export async function uploadFile(file: File, projectId?: string | number) {